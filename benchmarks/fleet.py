@@ -0,0 +1,43 @@
+# standard library
+import random
+from datetime import timedelta
+from typing import List, Tuple
+
+# fakefill plugin
+from fakefill.helpers.daginfo import DagInfo
+
+# Mix of the schedules found in a real fleet: fixed-interval crontabs and presets go through the epoch fast
+# path, the others are walked on the crontab
+SCHEDULES = [
+    "*/15 * * * *",
+    "5,35 * * * *",
+    "0 */2 * * *",
+    "0 9-17 * * 1-5",
+    "30 6 * * 1-5",
+    "0 0 1 * *",
+    "@hourly",
+    "@daily",
+    "@weekly",
+    "@monthly",
+    timedelta(minutes=30),
+    timedelta(hours=1),
+    timedelta(days=1),
+    None,
+]
+
+
+def build_fleet(dags: int, seed: int = 0) -> List[Tuple[str, DagInfo]]:
+    """ `dags` dags with schedules drawn from SCHEDULES, the same ones for a given seed """
+    rand = random.Random(seed)
+    fleet = []
+    for i in range(dags):
+        dag_id = f"bench_dag_{i:05d}"
+        info = DagInfo(
+            dag_id,
+            is_paused=rand.random() < 0.8,
+            is_subdag=False,
+            schedule_interval=rand.choice(SCHEDULES),
+            fileloc=f"/dags/{dag_id}.py",
+        )
+        fleet.append((dag_id, info))
+    return fleet
@@ -0,0 +1,166 @@
+# standard library
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+# pypi/conda library
+from pytz import utc
+from sqlalchemy import Column, MetaData, String, Table, inspect
+
+# fakefill plugin
+from fakefill.helpers import direct
+from fakefill.helpers.schedule import gen_run_dates, get_process_num, summarize_run_dates
+from fakefill.helpers.tables import dag_run_table, dag_table, encode_interval, metadata
+from fakefill.helpers.throttle import RateLimiter
+from fakefill.helpers.writers import BulkWriter, CopyWriter
+
+# Created next to the tables the benchmark fills, which it then allows to drop on the next runs
+GUARD_TABLE = Table("fakefill_benchmark", MetaData(), Column("note", String(250)))
+
+
+def timed(func: Callable, repeat: int = 1) -> Tuple[float, int]:
+    """ (best wall time in seconds, count returned by `func`) over `repeat` runs """
+    best, count = None, 0
+    for _ in range(max(1, repeat)):
+        started = perf_counter()
+        count = func()
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def result(stage: str, backend: str, seconds: float, rows: int, dags: int, repeat: int = 1) -> Dict:
+    return {
+        "stage": stage,
+        "backend": backend,
+        "dags": dags,
+        "rows": rows,
+        "repeat": repeat,
+        "seconds": round(seconds, 6),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+    }
+
+
+def schedule_stages(fleet: List, start_date: datetime, maximum_day: int, maximum_unit: int, repeat: int) -> List:
+    """ Stages without database: count, generate and summarize the run dates of the fleet """
+
+    def counts():
+        return sum(
+            get_process_num(dag.schedule_interval, start_date, maximum_day, maximum_unit)
+            for _, dag in fleet
+            if dag.schedule_interval
+        )
+
+    def run_dates():
+        return sum(len(gen_run_dates(dag, start_date, maximum_day, maximum_unit)[0]) for _, dag in fleet)
+
+    def plan():
+        return sum(summarize_run_dates(dag, start_date, maximum_day, maximum_unit)[0] for _, dag in fleet)
+
+    results = []
+    for stage, stage_func in (("counts", counts), ("run_dates", run_dates), ("plan", plan)):
+        seconds, rows = timed(stage_func, repeat)
+        results.append(result(stage, "none", seconds, rows, len(fleet), repeat))
+    return results
+
+
+def gen_dates(fleet: List, start_date: datetime, maximum_day: int, maximum_unit: int) -> Dict[str, Tuple]:
+    """ (run_dates, external_trigger) of every dag, as the fill hands them to the writers """
+    return {dag_id: gen_run_dates(dag, start_date, maximum_day, maximum_unit) for dag_id, dag in fleet}
+
+
+class QuietLog:
+    """ Drop the per-batch logs of the writers """
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: None
+
+
+def setup_database(engine, fleet: List, drop: bool = False):
+    """ Recreate the `dag` and `dag_run` tables, refusing to drop tables the benchmark didn't create """
+    tables = set(inspect(engine).get_table_names())
+    if tables & {dag_table.name, dag_run_table.name} and GUARD_TABLE.name not in tables and not drop:
+        raise RuntimeError(
+            f"{engine.url!r} has `dag` / `dag_run` tables the benchmark didn't create, pass --drop-tables to drop them"
+        )
+
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    GUARD_TABLE.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(
+            dag_table.insert(),
+            [
+                {
+                    "dag_id": dag_id,
+                    "is_paused": dag.is_paused,
+                    "is_subdag": dag.is_subdag,
+                    "is_active": True,
+                    "fileloc": dag.fileloc,
+                    "schedule_interval": encode_interval(dag.schedule_interval),
+                }
+                for dag_id, dag in fleet
+            ],
+        )
+
+
+def write_dates(writer, fleet: List, dates: Dict[str, Tuple]) -> int:
+    """ Write every dag through a writer of fakefill, return the dag runs inserted """
+    inserted = 0
+    for dag_id, dag in fleet:
+        run_dates, external_trigger = dates[dag_id]
+        inserted += writer.write(dag_id, dag, run_dates, external_trigger, log=QuietLog())[0]
+    return inserted
+
+
+def database_stages(url: str, fleet: List, dates: Dict[str, Tuple], batch_size: int, drop: bool = False) -> List:
+    """ Stages against a database: discovery, inserts, duplicate inserts, and the queries run before writing
+
+    They go through the direct database mode of fakefill: its discovery and queries, and the real writers.
+    """
+    direct.configure(url)
+    engine = direct.engine
+    backend = engine.dialect.name
+    dag_ids = [dag_id for dag_id, _ in fleet]
+    total = sum(len(run_dates) for run_dates, _ in dates.values())
+    setup_database(engine, fleet, drop=drop)
+    bulk = BulkWriter(limiter=RateLimiter(0), batch_size=batch_size, session_factory=direct.get_session)
+
+    def discovery():
+        return len(direct.discover_dags())
+
+    def recent():
+        return len(direct.get_last_executions(dag_ids))
+
+    def existing_dates():
+        return sum(
+            len(direct.get_existing_dates(dag_id, since=run_dates[-1]))
+            for dag_id, (run_dates, _) in dates.items()
+            if run_dates
+        )
+
+    results = []
+    seconds, count = timed(discovery)
+    results.append(result("discovery", backend, seconds, count, len(fleet)))
+    seconds, count = timed(lambda: write_dates(bulk, fleet, dates))
+    results.append(result("insert", backend, seconds, total, len(fleet)))
+    seconds, count = timed(lambda: write_dates(bulk, fleet, dates))
+    results.append(result("insert_duplicates", backend, seconds, total, len(fleet)))
+    seconds, count = timed(recent)
+    results.append(result("recent", backend, seconds, count, len(fleet)))
+    seconds, count = timed(existing_dates)
+    results.append(result("existing_dates", backend, seconds, count, len(fleet)))
+
+    if backend == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(dag_run_table.delete())
+        copy = CopyWriter(limiter=RateLimiter(0), batch_size=batch_size, session_factory=direct.get_session)
+        seconds, count = timed(lambda: write_dates(copy, fleet, dates))
+        results.append(result("copy", backend, seconds, total, len(fleet)))
+
+    engine.dispose()
+    return results
+
+
+def now() -> datetime:
+    return datetime.utcnow().replace(tzinfo=utc)
@@ -0,0 +1,65 @@
+# standard library
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Dict
+
+ROOT = Path(__file__).parent.parent
+
+# Never to be imported just to start the cli
+HEAVY_MODULES = ("airflow", "sqlalchemy", "pendulum", "numpy", "psycopg2")
+
+# (probe, heavy modules allowed, budget in seconds, None for the budget given to the benchmark)
+# `fakefill ...` runs the cli with these arguments, `import ...` imports the module a command loads when it runs.
+# `plan` computes the schedules and reads the database, it needs SQLAlchemy anyway. `{tmp}` is a scratch folder
+PROBES = (
+    ("fakefill --help", (), None),
+    ("fakefill template --help", (), None),
+    ("fakefill plan --help", (), None),
+    ("fakefill run --help", (), None),
+    ("fakefill merge-reports --help", (), None),
+    ("fakefill template -p {tmp}/config.yml", (), None),
+    ("import fakefill.planner", ("sqlalchemy", "pendulum", "numpy"), 2.0),
+)
+
+# Run in a fresh interpreter, the last line printed is the result
+PROBE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+if sys.argv[1] == "import":
+    importlib.import_module(sys.argv[2])
+else:
+    from fakefill.cli import cli
+    try:
+        cli(sys.argv[2:], standalone_mode=False)
+    except (Exception, SystemExit):
+        pass
+heavy = sorted(name for name in %(heavy)r if name in sys.modules)
+print(json.dumps({"import_seconds": time.perf_counter() - started, "heavy_modules": heavy}))
+"""
+
+
+def measure_startup(probe: str, repeat: int = 5) -> Dict:
+    """ Best wall time of a probe in a new process, and the heavy modules it imported """
+    best = None
+    with tempfile.TemporaryDirectory(prefix="fakefill_startup_") as tmp:
+        args = probe.format(tmp=tmp).split()
+        for _ in range(max(1, repeat)):
+            started = perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", PROBE % {"heavy": HEAVY_MODULES}, *args],
+                cwd=ROOT,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                check=True,
+            ).stdout
+            seconds = perf_counter() - started
+            result = json.loads(output.strip().splitlines()[-1])
+            if best is None or seconds < best["seconds"]:
+                best = {"command": probe.replace("{tmp}", "<tmp>"), "seconds": round(seconds, 4), **result}
+    best["import_seconds"] = round(best["import_seconds"], 4)
+    return best
@@ -1,32 +1,27 @@
 # standard library
 import sys
-from datetime import datetime, timedelta
-from time import sleep
-from typing import NoReturn
-
-# pypi/conda library
-from sqlalchemy.exc import IntegrityError
-
-try:
-    # pypi/conda library
-    from pendulum import Pendulum
-except Exception:
-    from pendulum import DateTime as Pendulum  # noqa
-
-# pypi/conda library
-from pytz import utc
-
-# airflow library
-from airflow.utils.state import State
+from datetime import timedelta
+from functools import partial
+from types import ModuleType
+from typing import Dict, List, NoReturn, Optional, Set, Tuple
 
 # fakefill plugin
-from fakefill.helpers.afutils import fetch_dag, gen_run_id, get_last_execution, trans_to_datetime
-from fakefill.helpers.cfutils import Datetime, check_recent, parse_bool, parse_date, read_config
-from fakefill.helpers.cronvert import cron_counts
+from fakefill.helpers.cfutils import Datetime, check_recent, parse_bool, parse_date, read_config, shard_of
+from fakefill.helpers.cronvert import cache_info
+from fakefill.helpers.journal import Journal, journal_path
 from fakefill.helpers.logging import getLogger
+from fakefill.helpers.metrics import Metrics, report_path
+from fakefill.helpers.pipeline import run_pipeline
+from fakefill.helpers.schedule import drop_dates, drop_spans, gen_run_dates
+from fakefill.helpers.throttle import RateLimiter
+from fakefill.helpers.workers import run_parallel
+from fakefill.helpers.writers import TaskInstanceWriter, get_writer
 
 logger = getLogger("catchup")
 
+# Dag runs per second of the orm writer when no row rate is given, the batch writers are not limited by default
+DEFAULT_ROW_RATE = 200
+
 
 def fakefill(
     dag_id: str,
@@ -38,6 +33,24 @@ def fakefill(
     p: bool,
     y: bool,
     v: bool,
+    writer: str = "orm",
+    batch_size: int = 1000,
+    row_rate: Optional[float] = None,
+    dag_rate: float = 0,
+    workers: int = 1,
+    resume: bool = False,
+    journal: str = "",
+    discovery: str = "dagbag",
+    export: str = "",
+    export_files: int = 1,
+    commit_size: int = 1,
+    task_instances: bool = False,
+    report: str = "",
+    metrics_port: int = 0,
+    pipeline: bool = False,
+    queue_size: int = 64,
+    shard: Optional[Tuple[int, int]] = None,
+    sql_alchemy_conn: str = "",
 ) -> NoReturn:
     # Set default
     ok_dag = 0
@@ -57,6 +70,177 @@ def fakefill(
     pause_only = parse_bool(configs.get("settings", {}).get("pause_only", p))
     confirm = parse_bool(configs.get("settings", {}).get("comfirm", y))
     traceback = parse_bool(configs.get("settings", {}).get("traceback", v))
+    workers = int(configs.get("settings", {}).get("workers", workers))
+    discovery = configs.get("settings", {}).get("discovery", discovery)
+    pipeline = parse_bool(configs.get("settings", {}).get("pipeline", pipeline))
+    queue_size = int(configs.get("settings", {}).get("queue_size", queue_size))
+    resume = parse_bool(configs.get("settings", {}).get("resume", resume))
+    journal = Journal(journal_path(configs.get("settings", {}).get("journal", journal), config_path, shard))
+    metrics = Metrics(shard=shard)
+    report = report_path(configs.get("settings", {}).get("report", report), config_path, shard)
+    metrics_port = int(configs.get("settings", {}).get("metrics_port", metrics_port))
+    server = metrics.serve(metrics_port) if metrics_port else None
+    dag_limiter = RateLimiter(float(configs.get("settings", {}).get("dag_rate", dag_rate)), name="dags")
+    batch_size = int(configs.get("settings", {}).get("batch_size", batch_size))
+    export = configs.get("settings", {}).get("export", export)
+    task_instances = parse_bool(configs.get("settings", {}).get("task_instances", task_instances))
+    writer = configs.get("settings", {}).get("writer", writer)
+    sql_alchemy_conn = configs.get("settings", {}).get("sql_alchemy_conn", sql_alchemy_conn)
+    backend = get_backend(sql_alchemy_conn)
+
+    # Without Airflow there is no `create_dagrun` nor task to read from the dag files
+    if sql_alchemy_conn and writer == "orm" and not export:
+        logger.warning("The orm writer needs Airflow, dag runs are written with multi-row inserts")
+        writer = "bulk"
+    if sql_alchemy_conn and task_instances:
+        logger.warning("Task instances need the dag files parsed by Airflow, only the dag runs are written")
+        task_instances = False
+
+    # A bulk or copy batch takes `batch_size` tokens at once, a 200 rows/s default would hold it for seconds
+    row_rate = configs.get("settings", {}).get("row_rate", row_rate)
+    if row_rate is None:
+        row_rate = DEFAULT_ROW_RATE if writer == "orm" and not export else 0
+    row_limiter = RateLimiter(float(row_rate), name="rows", observer=metrics.observe_commit)
+
+    writer = get_writer(
+        writer=writer,
+        batch_size=batch_size,
+        limiter=row_limiter,
+        export=export,
+        export_files=int(configs.get("settings", {}).get("export_files", export_files)),
+        append=resume,
+        commit_size=int(configs.get("settings", {}).get("commit_size", commit_size)),
+        session_factory=backend.get_session,
+    )
+
+    if task_instances and export:
+        logger.warning("Task instances are not exported, only the dag runs")
+        task_instances = False
+    ti_writer = (
+        TaskInstanceWriter(limiter=row_limiter, batch_size=batch_size, session_factory=backend.get_session)
+        if task_instances
+        else None
+    )
+
+    with metrics.stage("discovery"):
+        dagbag = collect_dags(
+            dag_id, configs, pause_only=pause_only, confirm=confirm, discovery=discovery, backend=backend
+        )
+
+    # Several processes share the fleet, each one keeps the dags hashed to its shard
+    if shard:
+        index, count = shard
+        dagbag = [dag for dag in dagbag if shard_of(dag[0], count) == index]
+        logger.info(f"Shard {index}/{count}: {len(dagbag)} dags")
+
+    # if not fill all schedules flag and has latest execution date, skip the dags which ran recently
+    if ignore:
+        with metrics.stage("recent"):
+            last_executions = backend.get_last_executions(dag_ids=[dag_id for dag_id, _ in dagbag])
+        recent = {dag_id for dag_id, date in last_executions.items() if check_recent(date)}
+        dagbag = [dag for dag in dagbag if dag[0] not in recent]
+        logger.info(f"Skip {len(recent)} dags which ran recently")
+
+    if len(dagbag) == 0:
+        logger.warning("Unable to fetch any dag by the given dag id(s)")
+        sys.exit(-1)
+    else:
+        logger.info(f"Got {len(dagbag)} dags to process")
+
+    # Checkpoint: skip what the previous run finished, or start a fresh journal
+    if resume:
+        finished, committed = journal.load()
+    else:
+        finished, committed = set(), {}
+        journal.reset()
+
+    fill = partial(
+        fill_dag,
+        writer=writer,
+        ti_writer=ti_writer,
+        dag_limiter=dag_limiter,
+        start_date=start_date,
+        maximum_day=maximum_day,
+        maximum_unit=maximum_unit,
+        traceback=traceback,
+        journal=journal,
+        finished=finished,
+        committed=committed,
+        metrics=metrics,
+        backend=backend,
+    )
+
+    if pipeline:
+        backend.check_pool_size(workers)
+        logger.info(f"Build the run dates while {workers} writers drain a queue of {queue_size} batches")
+        results = run_pipeline(
+            prepare=partial(
+                prepare_dag,
+                dag_limiter=dag_limiter,
+                start_date=start_date,
+                maximum_day=maximum_day,
+                maximum_unit=maximum_unit,
+                finished=finished,
+                committed=committed,
+                metrics=metrics,
+                backend=backend,
+            ),
+            write=partial(write_dates, writer=writer, ti_writer=ti_writer, journal=journal, metrics=metrics),
+            finish=partial(finish_dag, journal=journal, finished=finished, metrics=metrics),
+            fail=partial(fail_dag, traceback=traceback),
+            dagbag=dagbag,
+            writers=workers,
+            queue_size=queue_size,
+            batch_size=batch_size,
+        )
+    elif workers > 1:
+        backend.check_pool_size(workers)
+        logger.info(f"Spread {len(dagbag)} dags across {workers} workers")
+        results = run_parallel(fill, dagbag, workers)
+    else:
+        results = (fill(dag_id, dag, logger) for dag_id, dag in dagbag)
+
+    try:
+        with metrics.stage("fill", count=len(dagbag)):
+            for ok, _ in results:
+                ok_dag += ok
+    finally:
+        journal.flush()
+        writer.close()
+        metrics.write_report(report)
+        if server:
+            server.shutdown()
+
+    if ok_dag == len(dagbag):
+        msg = "Succeed to auto backfill all the dags" if ok_dag > 1 else "Succeed to auto backfill dag: {dag_id}"
+        logger.success(msg)
+    else:
+        logger.warning(f"Succeed to process {ok_dag} dags, and {len(dagbag) - ok_dag} failed")
+
+    cron_cache = cache_info()
+    logger.info(f"Parsed crontabs cache: {cron_cache.hits} hits, {cron_cache.misses} misses")
+
+
+def get_backend(sql_alchemy_conn: str = "") -> ModuleType:
+    """ afutils reading the metadata database through Airflow, or direct on a `sql_alchemy_conn` url without it """
+    if sql_alchemy_conn:
+        # fakefill plugin
+        from fakefill.helpers import direct
+
+        direct.configure(sql_alchemy_conn)
+        return direct
+
+    # fakefill plugin
+    from fakefill.helpers import afutils
+
+    return afutils
+
+
+def collect_dags(
+    dag_id: str, configs: Dict, pause_only: bool, confirm: bool, discovery: str, backend: ModuleType = None
+) -> List[Tuple]:
+    """ Dags to process: `dags.run_only` of the config or the given dag id, without `dags.excludes` """
+    backend = backend or get_backend()
 
     # Dags settings
     dags_yml = configs.get("dags", [])
@@ -65,97 +249,182 @@ def fakefill(
 
     # fetch dag
     if run_only:
-        dagbag = [fetch_dag(dag_id=dag_id, get_pause_only=pause_only, confirm=confirm) for dag_id in run_only]
+        dagbag = backend.fetch_dag(dag_id=run_only, get_pause_only=pause_only, confirm=confirm, discovery=discovery)
     elif dag_id:
-        dagbag = fetch_dag(dag_id=dag_id, get_pause_only=pause_only, confirm=confirm)
+        dagbag = backend.fetch_dag(dag_id=dag_id, get_pause_only=pause_only, confirm=confirm, discovery=discovery)
     else:
         raise ValueError(
             "Cannot find any dag_id. Make sure you passed the right config file or try `-d` to pass dag_id"
         )
 
-    dagbag = [dag for dag in dagbag if dag[0] not in exclude_dags]
+    return [dag for dag in dagbag if dag[0] not in exclude_dags]
 
-    if len(dagbag) == 0:
-        logger.warning("Unable to fetch any dag by the given dag id(s)")
-        sys.exit(-1)
-    else:
-        logger.info(f"Got {len(dagbag)} dags to process")
 
-    for dag_id, dag in dagbag:
-        try:
-            ok_task = 0
-
-            # Subdag will be ignored
-            if dag.is_subdag:
-                continue
-
-            # if not fill all schedules flag and has latest execution date, start from the recent execution date
-            if ignore and check_recent(get_last_execution(dag)):
-                continue
-
-            # If schedule is None: set external trigger to True
-            if dag.schedule_interval:
-                # get all the schdule starting from the given date
-                run_dates = dag.get_run_dates(start_date)
-                run_dates = [trans_to_datetime(rd) for rd in run_dates]
-                run_dates = [rd for rd in run_dates if rd]
-                run_dates.reverse()
-                external_trigger = False
-
-                num = (datetime.utcnow().replace(tzinfo=utc) - start_date).days
-                num = min(num, maximum_day) if maximum_day else num
-
-                # Maximum unit: set by crontab + maximum_xxx
-                process_num, daily_unit = cron_counts(dag.schedule_interval)
-                process_num = process_num * num if process_num <= 744 else daily_unit * num
-                process_num = min(maximum_unit, process_num)
-
-                if run_dates:
-                    run_dates = run_dates[:process_num] if len(run_dates) > process_num else run_dates
-                else:
-                    run_dates = [Pendulum.utcnow().replace(hour=0, minute=0, second=0)]
-            else:
-                fake_last_execution = (datetime.utcnow() - timedelta(days=1)).replace(tzinfo=utc)
-                run_dates = [fake_last_execution]
-                external_trigger = True
-
-            logger.info(f"{dag_id} has {len(run_dates)} tasks to be backfill")
-
-            for date in run_dates:
-                try:
-                    sdate = execution_date = date
-                    # generate run id -> migration_yyyy-mm-ddthh:mm:ss+00:00
-                    run_id = gen_run_id(start_date)
-                    dag.create_dagrun(
-                        run_id=run_id,
-                        state=State.SUCCESS,
-                        execution_date=execution_date,
-                        start_date=sdate,
-                        external_trigger=external_trigger,
-                    )
-                except IntegrityError:
-                    ok_task += 1
-                except Exception:
-                    logger.debug(f"cannot auto backfill for {dag_id} on date {execution_date}")
-                    pass
-                else:
-                    ok_task += 1
-                    sleep(0.5)
-
-        except Exception:
-            message = f"Cannot backfill dag: {dag_id}"
-            if traceback:
-                logger.exception(message)
-            else:
-                logger.error(message)
-        else:
-            ok_dag += 1
-            sleep(5)
-        finally:
-            logger.info(f"Total processed: {ok_task}")
+def fill_dag(
+    dag_id: str,
+    dag,
+    log,
+    *,
+    writer,
+    ti_writer: Optional[TaskInstanceWriter],
+    dag_limiter: RateLimiter,
+    start_date: Datetime,
+    maximum_day: int,
+    maximum_unit: int,
+    traceback: bool,
+    journal: Journal,
+    finished: Set[str],
+    committed: Dict[str, List[Tuple[Datetime, Datetime]]],
+    metrics: Metrics,
+    backend: ModuleType,
+) -> Tuple[bool, int]:
+    """ Fill one dag from start to end: prepare its run dates then write them """
+    ok = True
+
+    try:
+        prepared = prepare_dag(
+            dag_id,
+            dag,
+            log,
+            dag_limiter=dag_limiter,
+            start_date=start_date,
+            maximum_day=maximum_day,
+            maximum_unit=maximum_unit,
+            finished=finished,
+            committed=committed,
+            metrics=metrics,
+            backend=backend,
+        )
+        if prepared:
+            run_dates, external_trigger = prepared
+            write_dates(
+                dag_id,
+                dag,
+                run_dates,
+                external_trigger,
+                log,
+                writer=writer,
+                ti_writer=ti_writer,
+                journal=journal,
+                metrics=metrics,
+            )
+    except Exception:
+        fail_dag(dag_id, log, traceback=traceback)
+        ok = False
+
+    return finish_dag(dag_id, dag, log, ok, journal=journal, finished=finished, metrics=metrics)
+
+
+def prepare_dag(
+    dag_id: str,
+    dag,
+    log,
+    *,
+    dag_limiter: RateLimiter,
+    start_date: Datetime,
+    maximum_day: int,
+    maximum_unit: int,
+    finished: Set[str],
+    committed: Dict[str, List[Tuple[Datetime, Datetime]]],
+    metrics: Metrics,
+    backend: ModuleType,
+) -> Optional[Tuple]:
+    """ (run_dates, external_trigger) left to write for a dag, None if there is nothing to do """
+    record = metrics.start_dag(dag_id)
+
+    if dag_id in finished:
+        log.info(f"{dag_id} has been filled by the previous run")
+        return None
+
+    # Subdag will be ignored
+    if dag.is_subdag:
+        return None
+
+    dag_limiter.acquire()
+
+    with metrics.stage("run_dates"):
+        run_dates, external_trigger = gen_run_dates(dag, start_date, maximum_day, maximum_unit)
+
+    with metrics.stage("dedup"):
+        total = len(run_dates)
+
+        # Skip the dates committed before the previous run stopped
+        if dag_id in committed:
+            run_dates = drop_spans(run_dates, committed[dag_id])
+
+        # Skip the dates already in dag_run before trying to write them
+        existing = backend.get_existing_dates(dag_id=dag_id, since=run_dates[-1]) if run_dates else set()
+        if existing:
+            present = len(run_dates)
+            run_dates = drop_dates(run_dates, existing)
+            log.info(f"{dag_id} has {present - len(run_dates)} dag runs already present")
+
+    record["already_present"] = total - len(run_dates)
+    log.info(f"{dag_id} has {len(run_dates)} tasks to be backfill")
+    return run_dates, external_trigger
+
+
+def write_dates(
+    dag_id: str,
+    dag,
+    run_dates,
+    external_trigger: bool,
+    log,
+    *,
+    writer,
+    ti_writer: Optional[TaskInstanceWriter],
+    journal: Journal,
+    metrics: Metrics,
+):
+    """ Write run dates of a dag, all of them or one batch of the pipeline """
+    record = metrics.dags[dag_id]
+
+    with metrics.track(record):
+        with metrics.stage("write", count=len(run_dates)):
+            inserted, skipped, failed = writer.write(
+                dag_id, dag, run_dates, external_trigger, log=log, on_commit=journal.on_commit(dag_id, run_dates)
+            )
+        metrics.add(record, attempted=len(run_dates), inserted=inserted, duplicate=skipped, failed=failed)
+
+        if failed:
+            log.warning(f"{dag_id}: {failed} dag runs failed to be backfilled")
+
+        if ti_writer and run_dates:
+            with metrics.stage("task_instances"):
+                _, _, failed = ti_writer.write(dag_id, dag, run_dates, log=log)
+            if failed:
+                log.warning(f"{dag_id}: {failed} task instances failed to be backfilled")
+
+
+def fail_dag(dag_id: str, log, traceback: bool):
+    message = f"Cannot backfill dag: {dag_id}"
+    if traceback:
+        log.exception(message)
     else:
-        if ok_dag == len(dagbag):
-            msg = "Succeed to auto backfill all the dags" if ok_dag > 1 else "Succeed to auto backfill dag: {dag_id}"
-            logger.success(msg)
-        else:
-            logger.warning(f"Succeed to process {ok_dag} dags, and {len(dagbag) - ok_dag} failed")
+        log.error(message)
+
+
+def finish_dag(
+    dag_id: str, dag, log, ok: bool, *, journal: Journal, finished: Set[str], metrics: Metrics
+) -> Tuple[bool, int]:
+    """ (ok, processed dag runs) of a dag once all its dates are written """
+    record = metrics.dags[dag_id]
+    journal.close_span(dag_id)
+
+    if dag_id in finished:
+        ok = True
+    elif dag.is_subdag:
+        ok = False
+    elif record["failed"]:
+        # Not journaled as done: a resume writes the dates its committed spans leave out
+        log.error(f"{dag_id}: {record['failed']} dag runs failed, the dag is left to the next run")
+        ok = False
+    elif ok:
+        journal.done(dag_id)
+
+    record["ok"] = ok
+    metrics.finish_dag(record)
+
+    ok_task = record["already_present"] + record["inserted"] + record["duplicate"]
+    log.info(f"Total processed: {ok_task}")
+    return ok, ok_task
@@ -12,15 +12,16 @@ note that the run id will be `migration_yyyy-mm-ddthh:mm:ss+00:00`
 
 # standard library
 from pathlib import Path
+from typing import Optional, Tuple
 
 # pypi/conda library
 import click
 
 # fakefill plugin
-from fakefill.catchup import Datetime, fakefill
-from fakefill.helpers.cfutils import parse_date_cli
+from fakefill.helpers.cfutils import Datetime, parse_date_cli, parse_shard_cli
 from fakefill.helpers.logging import getLogger
-from fakefill.helpers.template import gen_template
+
+# Airflow and the database stack are imported by the commands which need them, keep `--help` and `template` light
 
 logger = getLogger("cfutils")
 
@@ -57,6 +58,115 @@ def cli():
 @click.option("-p", default=False, is_flag=True, help="only fill paused dags")
 @click.option("-y", default=False, is_flag=True, help="confirm by default")
 @click.option("-v", default=False, is_flag=True, help="print traceback if got error")
+@click.option(
+    "writer",
+    "-w",
+    default="orm",
+    type=click.Choice(["orm", "bulk", "copy"]),
+    help="write dag runs one by one with the orm, in bulk with multi-row inserts, or with postgres copy",
+)
+@click.option(
+    "batch_size", "-bs", default=1000, type=click.IntRange(min=1), help="rows per batch for the bulk and copy writers",
+)
+@click.option(
+    "commit_size",
+    "-cs",
+    default=1,
+    type=click.IntRange(min=1),
+    help="dag runs per transaction for the orm writer, 1 to commit each one through create_dagrun",
+)
+@click.option(
+    "task_instances",
+    "--task-instances",
+    "-ti",
+    default=False,
+    is_flag=True,
+    help="also write a task instance in state success for every task of the filled dag runs",
+)
+@click.option(
+    "row_rate",
+    "-rr",
+    default=None,
+    type=click.FLOAT,
+    help="target dag runs written per second, 0 for no limit, default: 200 for the orm writer, no limit otherwise",
+)
+@click.option("dag_rate", "-dr", default=0.0, type=click.FLOAT, help="target dags processed per second, 0 for no limit")
+@click.option(
+    "workers", "--workers", "-n", default=1, type=click.IntRange(min=1), help="number of dags to fill in parallel",
+)
+@click.option(
+    "pipeline",
+    "--pipeline",
+    default=False,
+    is_flag=True,
+    help="build the run dates of the next dags while the workers write the previous ones",
+)
+@click.option(
+    "queue_size",
+    "--queue-size",
+    default=64,
+    type=click.IntRange(min=1),
+    help="batches of run dates waiting to be written in pipeline mode",
+)
+@click.option("resume", "--resume", default=False, is_flag=True, help="skip the work finished by the previous run")
+@click.option(
+    "journal",
+    "-jp",
+    default="",
+    type=click.STRING,
+    help="path to the checkpoint journal, default will be next to the config, or in the current folder",
+)
+@click.option(
+    "discovery",
+    "-dm",
+    default="dagbag",
+    type=click.Choice(["dagbag", "db"]),
+    help="find the dags by parsing the dag files, or read them from the metadata database",
+)
+@click.option(
+    "export",
+    "--export",
+    "-e",
+    default="",
+    type=click.STRING,
+    help="write the dag runs to a gzip file instead of the database, .sql.gz for inserts, csv otherwise",
+)
+@click.option(
+    "shard",
+    "--shard",
+    default="",
+    type=click.STRING,
+    help="only fill the dags of shard i out of N, by hash of the dag id, e.g. 0/4",
+    callback=parse_shard_cli,
+)
+@click.option(
+    "report",
+    "--report",
+    default="",
+    type=click.STRING,
+    help="path to the json report of the run, default will be next to the config, or in the current folder",
+)
+@click.option(
+    "metrics_port",
+    "--metrics-port",
+    default=0,
+    type=click.IntRange(min=0, max=65535),
+    help="serve live prometheus metrics on this local port, 0 to disable",
+)
+@click.option(
+    "export_files",
+    "--export-files",
+    default=1,
+    type=click.IntRange(min=1),
+    help="split the export into N files by dag id hash",
+)
+@click.option(
+    "sql_alchemy_conn",
+    "--sql-alchemy-conn",
+    default="",
+    type=click.STRING,
+    help="url of the metadata database, read and written with sqlalchemy alone, without airflow installed",
+)
 def run(
     dag_id: str,
     start_date: Datetime,
@@ -67,6 +177,134 @@ def run(
     p: bool,
     y: bool,
     v: bool,
+    writer: str,
+    batch_size: int,
+    commit_size: int,
+    task_instances: bool,
+    row_rate: float,
+    dag_rate: float,
+    workers: int,
+    pipeline: bool,
+    queue_size: int,
+    resume: bool,
+    journal: str,
+    discovery: str,
+    export: str,
+    shard: Optional[Tuple[int, int]],
+    report: str,
+    metrics_port: int,
+    export_files: int,
+    sql_alchemy_conn: str,
+):
+    ctx = click.get_current_context()
+
+    if not dag_id and not Path(config_path).is_file():
+        logger.error("Need to assign a dag id or a path to config yaml")
+        ctx.abort()
+
+    # fakefill plugin
+    from fakefill.catchup import fakefill
+
+    fakefill(
+        dag_id,
+        start_date,
+        maximum_day,
+        maximum_unit,
+        config_path,
+        i,
+        p,
+        y,
+        v,
+        writer=writer,
+        batch_size=batch_size,
+        row_rate=row_rate,
+        dag_rate=dag_rate,
+        workers=workers,
+        resume=resume,
+        journal=journal,
+        discovery=discovery,
+        export=export,
+        export_files=export_files,
+        commit_size=commit_size,
+        task_instances=task_instances,
+        report=report,
+        metrics_port=metrics_port,
+        pipeline=pipeline,
+        queue_size=queue_size,
+        shard=shard,
+        sql_alchemy_conn=sql_alchemy_conn,
+    )
+
+
+@cli.command()
+@click.option(
+    "dag_id", "-d", default="", type=click.STRING, help="the dag name you want to plan [dag_id or all]",
+)
+@click.option(
+    "start_date",
+    "-sd",
+    default="",
+    type=click.STRING,
+    help="start date you want to backfill, default will fetch the start_date defined in the config of that dag",
+    callback=parse_date_cli,
+)
+@click.option(
+    "maximum_day", "-md", default=180, type=click.IntRange(min=0, max=180, clamp=True), help="maximum days to backfill",
+)
+@click.option(
+    "maximum_unit",
+    "-mu",
+    default=60 * 24 * 30,
+    type=click.IntRange(min=1, max=60 * 24 * 30, clamp=True),
+    help="max unit (based on the crontab) to backfill",
+)
+@click.option("config_path", "-cp", default="", type=click.STRING, help="config for auto fastfill if have one")
+@click.option("-p", default=False, is_flag=True, help="only plan paused dags")
+@click.option(
+    "discovery",
+    "-dm",
+    default="dagbag",
+    type=click.Choice(["dagbag", "db"]),
+    help="find the dags by parsing the dag files, or read them from the metadata database",
+)
+@click.option(
+    "writer",
+    "-w",
+    default="orm",
+    type=click.Choice(["orm", "bulk", "copy"]),
+    help="writer of the run, only the orm writer is rate limited by default",
+)
+@click.option(
+    "row_rate",
+    "-rr",
+    default=None,
+    type=click.FLOAT,
+    help="dag runs written per second to estimate the duration, default: 200 for the orm writer, no estimate otherwise",
+)
+@click.option(
+    "output", "-o", default="", type=click.STRING, help="plan file, default: ./fakefill_plan.<format>, - for stdout",
+)
+@click.option("fmt", "-f", default="csv", type=click.Choice(["csv", "json"]), help="csv, or json with one dag per line")
+@click.option(
+    "sql_alchemy_conn",
+    "--sql-alchemy-conn",
+    default="",
+    type=click.STRING,
+    help="url of the metadata database, read and written with sqlalchemy alone, without airflow installed",
+)
+def plan(
+    dag_id: str,
+    start_date: Datetime,
+    maximum_day: int,
+    maximum_unit: int,
+    config_path: str,
+    p: bool,
+    discovery: str,
+    writer: str,
+    row_rate: Optional[float],
+    output: str,
+    fmt: str,
+    sql_alchemy_conn: str,
 ):
     ctx = click.get_current_context()
 
@@ -74,12 +312,42 @@ def run(
         logger.error("Need to assign a dag id or a path to config yaml")
         ctx.abort()
 
-    fakefill(dag_id, start_date, maximum_day, maximum_unit, config_path, i, p, y, v)
+    # fakefill plugin
+    from fakefill.planner import plan as plan_fill
+
+    plan_fill(
+        dag_id,
+        start_date,
+        maximum_day,
+        maximum_unit,
+        config_path,
+        p,
+        discovery=discovery,
+        writer=writer,
+        row_rate=row_rate,
+        output=output,
+        fmt=fmt,
+        sql_alchemy_conn=sql_alchemy_conn,
+    )
+
+
+@cli.command("merge-reports")
+@click.argument("reports", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("output", "-o", default="fakefill.report.json", type=click.STRING, help="path to the merged report")
+def merge_reports(reports: Tuple[str], output: str):
+    """ Combine the reports of the shards of a run into one """
+    # fakefill plugin
+    from fakefill.helpers.metrics import merge_report_files
+
+    merge_report_files(list(reports), output)
 
 
 @cli.command()
 @click.option("template_path", "-p", default="", type=click.STRING, help="Generate a config template yaml")
 def template(template_path):
+    # fakefill plugin
+    from fakefill.helpers.template import gen_template
+
     gen_template(path=template_path)
 
 
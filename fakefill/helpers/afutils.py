@@ -1,110 +1,180 @@
 # standard library
 import os
-import sys
-from datetime import datetime, timedelta
-from typing import List, Tuple, TypeVar, Union
+from datetime import datetime
+from threading import Lock
+from typing import Dict, List, Set, Tuple, TypeVar, Union
 
 # pypi/conda library
-import click
-
-try:
-    # pypi/conda library
-    from pendulum import Pendulum
-except Exception:
-    from pendulum import DateTime as Pendulum  # noqa
-
-# pypi/conda library
-from pytz import utc
+from sqlalchemy import func
 
 # airflow library
-from airflow.models import DAG, DagBag, DagModel
+from airflow.models import DAG, DagBag, DagModel, DagRun
 from airflow.utils.db import provide_session
 
+try:
+    # airflow library
+    from airflow.utils.file import list_py_file_paths
+except ImportError:
+    from airflow.utils.dag_processing import list_py_file_paths
+
 # fakefill plugin
-from fakefill.helpers.exceptions import DagNotFoundError
+from fakefill.helpers.dagcache import load_dag_files
+from fakefill.helpers.daginfo import DagInfo, serialized_start_date, serialized_timezone
 from fakefill.helpers.logging import getLogger
+from fakefill.helpers.schedule import timezone_name, to_epoch
+from fakefill.helpers.selection import fetch_in_chunks, last_executions, select_dags
 
 Datetime = TypeVar("datetime", bound=datetime)
 logger = getLogger("afutils")
 
+# DagBag of each dag file the fill had to parse, the dags of a file share one parse
+dagbags: Dict[str, DagBag] = {}
+dagbags_lock = Lock()
+
 
 @provide_session
 def get_session(session):
     return session
 
 
-def get_dag(dag) -> Tuple[str, DAG]:
+def check_pool_size(workers: int):
     try:
-        dag = dag.get_dag()
-        return (dag.dag_id, dag)
+        # airflow library
+        from airflow import settings
+
+        pool_size = settings.engine.pool.size()
     except Exception:
-        return (dag.dag_id, dag)
+        return
+
+    if pool_size < workers:
+        logger.warning(
+            f"Airflow connection pool size is {pool_size} for {workers} workers, "
+            "raise `sql_alchemy_pool_size` to give each worker its own connection"
+        )
+
+
+def get_dags(models: List[DagModel]) -> List[Tuple[str, DAG]]:
+    try:
+        dags = dict(load_dag_files(sorted({model.fileloc for model in models}), loader=load_dag))
+        set_paused(dags=dags)
+        return [(model.dag_id, dags.get(model.dag_id, model)) for model in models]
+    except Exception:
+        return [(model.dag_id, model) for model in models]
+
+
+@provide_session
+def set_paused(session, dags: Dict[str, DagInfo]):
+    """ Pause state comes from the database, never from the cache """
+    query = session.query(DagModel.dag_id, DagModel.is_paused)
+    for dag_id, is_paused in fetch_in_chunks(list(dags), lambda chunk: query.filter(DagModel.dag_id.in_(chunk)).all()):
+        dags[dag_id].is_paused = is_paused
+    for dag in dags.values():
+        dag.is_paused = bool(dag.is_paused)
 
 
 def get_all_dags(get_pause_only: bool):
     airflow_home = os.environ["AIRFLOW_HOME"]
     dags_home = os.path.join(airflow_home, "dags", "dags")
-    dagbag = DagBag(dags_home)
+    dagbag = dict(load_dag_files(list_py_file_paths(dags_home, include_examples=False), loader=load_dag))
+    set_paused(dags=dagbag)
     if get_pause_only:
-        dagbag = [(dag_id, dag) for dag_id, dag in dagbag.dags.items() if dag.is_paused]
+        dagbag = [(dag_id, dag) for dag_id, dag in dagbag.items() if dag.is_paused]
     else:
-        dagbag = [(dag_id, dag) for dag_id, dag in dagbag.dags.items()]
+        dagbag = [(dag_id, dag) for dag_id, dag in dagbag.items()]
     return dagbag
 
 
-def gen_run_id(start_date):
-    date = start_date.strftime("%Y-%m-%d")
-    time = start_date.strftime("%H:%M:%S")
-    tz_info = start_date.strftime("%z")
-    tz = f"{tz_info[:3]}:{tz_info[3:]}"
-    run_id = f"migration__{date}T{time}{tz}"
-    return run_id
+def default_timezone() -> str:
+    """ `core.default_timezone`, the timezone of the dags which don't set one """
+    # airflow library
+    from airflow import settings
 
+    return timezone_name(settings.TIMEZONE)
 
-@provide_session
-def fetch_dag(session, dag_id: str, get_pause_only: bool, confirm: bool) -> List[Tuple[str, DAG]]:
-    dags = []
 
-    msg = "You are going to backfill all the dags" if dag_id == "all" else f"You are going to backfill {dag_id}?"
+def load_dag(info: DagInfo) -> DAG:
+    """ The real dag behind a DagInfo, its file parsed once for all the dags it defines """
+    with dagbags_lock:
+        if info.fileloc not in dagbags:
+            dagbags[info.fileloc] = DagBag(info.fileloc, include_examples=False)
+        return dagbags[info.fileloc].get_dag(info.dag_id)
 
-    if not confirm and dag_id:
-        click.confirm(f"{msg}, sure about that?", abort=True)
-    elif dag_id == "all" and confirm:
-        logger.warning(msg)
 
+@provide_session
+def discover_dags(session, dag_ids: List[str] = None, get_pause_only: bool = False) -> List[Tuple[str, DagInfo]]:
+    """ Read the dags from the `dag` and `serialized_dag` tables in one query, without parsing the dag files """
     try:
-        if dag_id and dag_id != "all":
-            dags = session.query(DagModel).filter(DagModel.dag_id == dag_id).all()
-            if dags:
-                dags = [get_dag(dag) for dag in dags]
-            else:
-                raise DagNotFoundError
-        elif dag_id == "all":
-            dags = get_all_dags(get_pause_only)
-        else:
-            logger.error(f"Unable to fetch dag(s). Need to assign a dag id")
-            sys.exit(-1)
-    except Exception as e:
-        raise e
-    else:
-        return dags
+        # airflow library
+        from airflow.models.serialized_dag import SerializedDagModel
 
+        data = getattr(SerializedDagModel, "_data", None) or SerializedDagModel.data
+    except ImportError:
+        SerializedDagModel = data = None
 
-def get_last_execution(dag):
-    try:
-        date = dag.latest_execution_date
-    except Exception:
-        date = dag.get_latest_execution_date()
-    finally:
-        if not date:
-            date = datetime.now(utc).replace(minute=0, second=0, microsecond=0) - timedelta(days=180)
-        return date
-
-
-def trans_to_datetime(dtobj: Union[Pendulum, Datetime]) -> Datetime:
-    if isinstance(dtobj, Pendulum):
-        return datetime.fromtimestamp(dtobj.timestamp()).replace(tzinfo=utc)
-    elif isinstance(dtobj, datetime):
-        return dtobj
+    columns = [DagModel.dag_id, DagModel.is_paused, DagModel.is_subdag, DagModel.schedule_interval, DagModel.fileloc]
+    query = session.query(*columns, data) if data is not None else session.query(*columns)
+    if SerializedDagModel is not None:
+        query = query.outerjoin(SerializedDagModel, SerializedDagModel.dag_id == DagModel.dag_id)
+
+    if get_pause_only:
+        query = query.filter(DagModel.is_paused.is_(True))
+
+    if dag_ids:
+        rows = fetch_in_chunks(dag_ids, lambda chunk: query.filter(DagModel.dag_id.in_(chunk)).all())
     else:
-        return None
+        rows = query.filter(DagModel.is_active.is_(True)).all()
+
+    dags = []
+    # unknown without serialized dags (Airflow 1.10 defaults), reading it from the dag would parse its file
+    default = default_timezone()
+    for dag_id, is_paused, is_subdag, schedule_interval, fileloc, *serialized in rows:
+        start_date = serialized_start_date(serialized[0]) if serialized else None
+        timezone = (serialized_timezone(serialized[0]) if serialized else None) or default
+        info = DagInfo(
+            dag_id,
+            is_paused,
+            is_subdag,
+            schedule_interval,
+            start_date,
+            fileloc=fileloc,
+            loader=load_dag,
+            timezone=timezone,
+        )
+        dags.append((dag_id, info))
+
+    logger.info(f"Discovered {len(dags)} dags from the metadata database")
+    return dags
+
+
+@provide_session
+def fetch_dag(
+    session, dag_id: Union[str, List[str]], get_pause_only: bool, confirm: bool, discovery: str = "dagbag"
+) -> List[Tuple[str, DAG]]:
+    """ Fetch one dag, "all" the dags, or a list of dag ids resolved together """
+    if discovery == "db":
+        return select_dags(
+            dag_id,
+            confirm,
+            fetch_all=lambda: discover_dags(session=session, get_pause_only=get_pause_only),
+            fetch_ids=lambda dag_ids: discover_dags(session=session, dag_ids=dag_ids),
+        )
+
+    def fetch_models(dag_ids: List[str]) -> List[Tuple[str, DAG]]:
+        query = session.query(DagModel)
+        return get_dags(fetch_in_chunks(dag_ids, lambda chunk: query.filter(DagModel.dag_id.in_(chunk)).all()))
+
+    return select_dags(dag_id, confirm, fetch_all=lambda: get_all_dags(get_pause_only), fetch_ids=fetch_models)
+
+
+@provide_session
+def get_existing_dates(session, dag_id: str, since: Datetime) -> Set[int]:
+    """ Epoch seconds of the execution dates already in dag_run for a dag, from `since` onward """
+    rows = session.query(DagRun.execution_date).filter(DagRun.dag_id == dag_id, DagRun.execution_date >= since).all()
+    return {to_epoch(execution_date) for execution_date, in rows}
+
+
+@provide_session
+def get_last_executions(session, dag_ids: List[str]) -> Dict[str, Datetime]:
+    """ Latest execution date of each dag, one grouped query per chunk of dag ids """
+    query = session.query(DagRun.dag_id, func.max(DagRun.execution_date)).group_by(DagRun.dag_id)
+    return last_executions(dag_ids, lambda chunk: query.filter(DagRun.dag_id.in_(chunk)).all())
@@ -1,10 +1,13 @@
 # standard library
 import re
+import zlib
 from datetime import datetime, timedelta
+from itertools import islice
 from pathlib import Path
-from typing import Dict, TypeVar, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 
 # pypi/conda library
+import click
 from pytz import utc
 from yaml import unsafe_load
 
@@ -26,6 +29,18 @@ def parse_date_cli(ctx, param, conf) -> Datetime:
     return ""
 
 
+def parse_shard_cli(ctx, param, conf) -> Optional[Tuple[int, int]]:
+    if not conf:
+        return None
+    try:
+        index, count = (int(part) for part in conf.split("/"))
+        if not 0 <= index < count:
+            raise ValueError
+    except ValueError:
+        raise click.BadParameter("expected i/N with 0 <= i < N, e.g. 0/4")
+    return index, count
+
+
 def parse_format(time_str):
     datetime_group = re.split(r"(<?\s|T)", time_str, 1)
 
@@ -94,6 +109,32 @@ def check_recent(lastrun: datetime) -> bool:
     return False
 
 
+def chunks(seq: Sequence, size: int):
+    for i in range(0, len(seq), size):
+        yield seq[i : i + size]
+
+
+def batches(iterable: Iterable, size: int) -> Iterator[List]:
+    """ Like `chunks`, for an iterator """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def shard_of(key: str, shards: int) -> int:
+    """ Stable shard of a key, unlike `hash` it doesn't change between processes """
+    return zlib.crc32(key.encode()) % shards
+
+
+def shard_suffix(shard: Optional[Tuple[int, int]]) -> str:
+    """ Suffix telling apart the files of the shards of a run: ".shard-0-of-4" """
+    if not shard:
+        return ""
+    return f".shard-{shard[0]}-of-{shard[1]}"
+
+
 def read_config(config_path) -> Union[Dict, None]:
     if not Path(config_path).is_file:
         raise FileNotFoundError
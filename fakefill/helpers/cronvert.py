@@ -1,12 +1,8 @@
 # standard library
 import re
-from datetime import datetime
-from typing import TypeVar
-
-# fakefill plugin
-from fakefill.helpers.logging import getLogger
-
-logger = getLogger("cronvert")
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple, TypeVar
 
 Datetime = TypeVar("datetime", bound=datetime)
 
@@ -34,14 +30,228 @@ SUBSTITUTIONS = {
 VALIDATE_POUND = re.compile("^[0-6]#[1-5]")
 VALIDATE_L_IN_DOW = re.compile("^[0-6]L$")
 VALIDATE_W = re.compile("^[0-3]?[0-9]W$")
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 4
+FIELD_MIN = dict(zip(("minute", "hour", "dom", "month", "dow"), (lo for lo, _ in FIELD_RANGES)))
+# Distinct crontabs kept parsed
+CACHE_SIZE = 1024
+
+
+def popcount(bits: int) -> int:
+    return bin(bits).count("1")
+
+
+class CronMask:
+    """ Parsed crontab as 5 fixed-width bitmasks (60/24/31/12/7 bits)
+
+    Bit i of a field is set when `field minimum + i` fires, e.g. `dom` bit 0 is the 1st of the month.
+    Instances are immutable and shared through the parsed crontab cache.
+    """
+
+    __slots__ = ("minute", "hour", "dom", "month", "dow")
+
+    def __init__(self, minute: int, hour: int, dom: int, month: int, dow: int):
+        for field, bits in zip(self.__slots__, (minute, hour, dom, month, dow)):
+            object.__setattr__(self, field, bits)
+
+    @classmethod
+    def from_numtab(cls, numerical_tab: List[set]) -> "CronMask":
+        return cls(*(sum(1 << (v - lo) for v in values) for values, (lo, _) in zip(numerical_tab, FIELD_RANGES)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, CronMask) and self.__reduce__() == other.__reduce__()
+
+    def __hash__(self):
+        return hash(self.__reduce__()[1])
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field):#x}" for field in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+    def has(self, field: str, value: int) -> bool:
+        return bool(getattr(self, field) >> (value - FIELD_MIN[field]) & 1)
+
+    def count(self, field: str, below: int = None) -> int:
+        """ Number of values set in a field, only the ones < `below` if given """
+        bits = getattr(self, field)
+        if below is not None:
+            bits &= (1 << max(below - FIELD_MIN[field], 0)) - 1
+        return popcount(bits)
+
+    def next_set(self, field: str, value: int) -> Optional[int]:
+        """ Smallest value set in a field, >= `value` """
+        lo = FIELD_MIN[field]
+        bits = getattr(self, field) >> max(value - lo, 0) << max(value - lo, 0)
+        return (bits & -bits).bit_length() - 1 + lo if bits else None
+
+    def prev_set(self, field: str, value: int) -> Optional[int]:
+        """ Largest value set in a field, <= `value` """
+        lo = FIELD_MIN[field]
+        if value < lo:
+            return None
+        bits = getattr(self, field) & ((1 << (value - lo + 1)) - 1)
+        return bits.bit_length() - 1 + lo if bits else None
+
+    def values(self, field: str) -> Iterator[int]:
+        value = self.next_set(field, FIELD_MIN[field])
+        while value is not None:
+            yield value
+            value = self.next_set(field, value + 1)
+
+
+def split_cron(line: str) -> Tuple[List[str], str]:
+    """ Rewrite presets, month and day names, then split a crontab into its 5 fields and a comment """
+    for key, value in list(SUBSTITUTIONS.items()):
+        if line.startswith(key):
+            line = line.replace(key, value)
+            break
+
+    fields = line.split(None, 5)
+    if len(fields) == 5:
+        fields.append("")
+
+    minutes, hours, dom, months, dow, comment = fields
+
+    dow = dow.replace("7", "0").replace("?", "*")
+    dom = dom.replace("?", "*")
+
+    for monthstr, monthnum in MONTH_NAMES:
+        months = months.upper().replace(monthstr, str(monthnum))
+
+    for dowstr, downum in DAY_NAMES:
+        dow = dow.upper().replace(dowstr, str(downum))
+
+    return [minutes, hours, dom, months, dow], comment
+
+
+def normalize_cron(cronexpr: str) -> str:
+    string_tab, _ = split_cron(cronexpr.strip())
+    return " ".join(string_tab)
+
+
+def parse_cron(cronexpr: str) -> CronMask:
+    """ Parsed fields of a crontab, shared by all the crontabs that normalise to the same expression """
+    return _parse_cron(normalize_cron(cronexpr))
 
 
-def cron_counts(cronexpr: str) -> int:
-    try:
-        return __CronToMonthly__(cronexpr)()
-    except Exception:
-        logger.warning(f"Cannot parse cron expression: {cronexpr}. Using default value: 30")
-        return 30
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_cron(normalized: str) -> CronMask:
+    cron = __CronToMonthly__(normalized)
+    # L, W, # and % depend on the month or the week, the masks cannot hold them: let Airflow build those schedules
+    for field, span in zip(cron.string_tab, FIELD_RANGES):
+        if any(is_special_atom(atom, span) for atom in field.split(",")):
+            raise ValueError(f"Special characters are not supported in {field!r} of {normalized!r}")
+    return CronMask.from_numtab(cron.numerical_tab)
+
+
+def cache_info():
+    """ (hits, misses, maxsize, currsize) of the parsed crontab cache """
+    return _parse_cron.cache_info()
+
+
+def iter_cron_dates(cronexpr: str, start: Datetime, end: Datetime) -> Iterator[Datetime]:
+    """ Walk the fire times of a cron expression backwards, from `end` down to `start` (both included)
+
+    Nothing is materialised: days are checked one by one against the parsed fields, so the caller can stop
+    after the first n dates at the cost of n dates, whatever the length of the window.
+    Weekday and day of month are or-ed like cron does, `numerical_tab` empties the one left to "*".
+    """
+    mask = parse_cron(cronexpr)
+
+    day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day >= first_day:
+        if day_matches(day, mask):
+            hour = mask.prev_set("hour", HOURS[1])
+            while hour is not None:
+                minute = mask.prev_set("minute", MINUTES[1])
+                while minute is not None:
+                    date = day.replace(hour=hour, minute=minute)
+                    if date < start:
+                        return
+                    if date <= end:
+                        yield date
+                    minute = mask.prev_set("minute", minute - 1)
+                hour = mask.prev_set("hour", hour - 1)
+        day -= timedelta(days=1)
+
+
+def count_cron_dates(cronexpr: str, start: Datetime, end: Datetime) -> int:
+    """ Exact number of fire times of a cron expression in [start, end)
+
+    Whole days add minutes x hours when the day matches, only the first and last days are cut at the minute,
+    so the cost is one check per day of the window.
+    """
+    mask = parse_cron(cronexpr)
+    per_minute = mask.count("minute")
+
+    if not (per_minute and mask.hour) or start >= end:
+        return 0
+
+    def fired_before(minute_of_day: int) -> int:
+        # fire times of a matching day before `minute_of_day`
+        hour, minute = divmod(minute_of_day, 60)
+        before = mask.count("hour", below=hour) * per_minute
+        if hour <= HOURS[1] and mask.has("hour", hour):
+            before += mask.count("minute", below=minute)
+        return before
+
+    def minute_of_day(moment: Datetime) -> int:
+        # first minute of the day at or after `moment`
+        return -(-int((moment - moment.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()) // 60)
+
+    per_day = fired_before(1440)
+    first_day = start.toordinal()
+    last_day = end.toordinal()
+
+    total = 0
+    for ordinal in range(first_day, last_day + 1):
+        if not day_matches(date.fromordinal(ordinal), mask):
+            continue
+        lo = fired_before(minute_of_day(start)) if ordinal == first_day else 0
+        hi = fired_before(minute_of_day(end)) if ordinal == last_day else per_day
+        total += hi - lo
+
+    return total
+
+
+def day_matches(day: date, mask: CronMask) -> bool:
+    # cron weekday: 0 is Sunday, python weekday: 0 is Monday
+    return mask.has("month", day.month) and (mask.has("dom", day.day) or mask.has("dow", (day.weekday() + 1) % 7))
+
+
+def fixed_interval(cronexpr: str) -> Optional[Tuple[int, int]]:
+    """ Return (step, offset) in seconds if the fire times are `offset + k * step` since epoch, else None
+
+    That is the case of @hourly, @daily, @weekly, `*/15 * * * *`, `30 */6 * * *`...
+    """
+    mask = parse_cron(cronexpr)
+
+    if not (mask.minute and mask.hour) or mask.count("month") != 12:
+        return None
+
+    times = [h * 60 + m for h in mask.values("hour") for m in mask.values("minute")]
+
+    # every day
+    if mask.count("dom") == 31 and mask.count("dow") == 7:
+        steps = {b - a for a, b in zip(times, times[1:] + [times[0] + 1440])}
+        if len(steps) == 1:
+            step = steps.pop()
+            return step * 60, (times[0] % step) * 60
+        return None
+
+    # once a week
+    if not mask.dom and mask.count("dow") == 1 and len(times) == 1:
+        days = (mask.next_set("dow", 0) - EPOCH_WEEKDAY) % 7
+        return 7 * 86400, days * 86400 + times[0] * 60
+
+    return None
 
 
 class __CronToMonthly__:
@@ -55,30 +265,6 @@ class __CronToMonthly__:
         """
         self.compute_epoch(line, epoch=DEFAULT_EPOCH, epoch_utc_offset=0)
 
-    def __call__(self) -> int:
-        """ This method is just to calculate an approximate upper limit.
-        Crontab like `* 8 1 * Sun` will be round up to "every minute past hour 8 on first day of month"
-        i.e. Weekday will be dropped if get month day
-
-        Range -> 0 <= base_unit <= 1440 per day
-        """
-        minute, hour, day, _, _ = self.numerical_tab
-
-        # Get execution times
-        count_min = len(minute)
-        count_hour = len(hour)
-        count_day = len(day)
-
-        base_unit = 1
-        daily_unit = 1
-
-        base_unit *= count_min if count_min else base_unit
-        base_unit *= count_hour if count_hour else base_unit
-        daily_unit = base_unit
-        base_unit *= count_day if count_day else base_unit
-
-        return base_unit, daily_unit
-
     def __repr__(self):
         base = self.__class__.__name__ + "(%s)"
         cron_line = self.string_tab + [str(self.comment)]
@@ -94,27 +280,7 @@ class __CronToMonthly__:
         return repr(self)
 
     def compute_epoch(self, line: str, epoch=DEFAULT_EPOCH, epoch_utc_offset: int = 0):
-        for key, value in list(SUBSTITUTIONS.items()):
-            if line.startswith(key):
-                line = line.replace(key, value)
-                break
-
-        fields = line.split(None, 5)
-        if len(fields) == 5:
-            fields.append("")
-
-        minutes, hours, dom, months, dow, self.comment = fields
-
-        dow = dow.replace("7", "0").replace("?", "*")
-        dom = dom.replace("?", "*")
-
-        for monthstr, monthnum in MONTH_NAMES:
-            months = months.upper().replace(monthstr, str(monthnum))
-
-        for dowstr, downum in DAY_NAMES:
-            dow = dow.upper().replace(dowstr, str(downum))
-
-        self.string_tab = [minutes, hours, dom, months, dow]
+        self.string_tab, self.comment = split_cron(line)
         self.compute_numtab()
         if len(epoch) == 5:
             y, mo, d, h, m = epoch
@@ -0,0 +1,124 @@
+# standard library
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# pypi/conda library
+from pytz import utc
+
+# fakefill plugin
+from fakefill.helpers.daginfo import DagInfo
+from fakefill.helpers.logging import getLogger
+from fakefill.helpers.schedule import timezone_name
+
+logger = getLogger("dagcache")
+
+CACHE_FILE = ".fakefill_dagbag_cache.json"
+CACHE_VERSION = 2
+
+
+def cache_path() -> Path:
+    return Path(os.environ["AIRFLOW_HOME"]) / CACHE_FILE
+
+
+def encode_schedule(schedule_interval) -> List:
+    if schedule_interval is None:
+        return ["none"]
+    if isinstance(schedule_interval, str):
+        return ["cron", schedule_interval]
+    if isinstance(schedule_interval, timedelta):
+        return ["timedelta", schedule_interval.total_seconds()]
+    # relativedelta... the dag file will be parsed when the fill needs it
+    return ["other"]
+
+
+def decode_schedule(encoded: List):
+    kind = encoded[0]
+    if kind == "cron":
+        return encoded[1]
+    if kind == "timedelta":
+        return timedelta(seconds=encoded[1])
+    return None
+
+
+def parse_file(path: str) -> List[Tuple]:
+    """ (dag_id, schedule_interval, start_date, is_subdag, timezone) of the dags of a file, run in a worker process """
+    # airflow library
+    from airflow.models import DagBag
+
+    dags = []
+    for dag_id, dag in DagBag(path, include_examples=False).dags.items():
+        start_date = dag.start_date.timestamp() if dag.start_date else None
+        timezone = timezone_name(dag.timezone) if dag.timezone else None
+        dags.append((dag_id, encode_schedule(dag.schedule_interval), start_date, bool(dag.is_subdag), timezone))
+    return dags
+
+
+def read_cache(path: Path) -> Dict:
+    try:
+        with open(path) as file:
+            cache = json.load(file)
+        if cache.get("version") == CACHE_VERSION:
+            return cache["files"]
+    except Exception:
+        pass
+    return {}
+
+
+def write_cache(path: Path, files: Dict):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as file:
+        json.dump({"version": CACHE_VERSION, "files": files}, file)
+    os.replace(tmp, path)
+
+
+def load_dag_files(paths: List[str], loader, workers: int = None) -> List[Tuple[str, DagInfo]]:
+    """ DagInfo of every dag defined in `paths`
+
+    A file is parsed again only if its mtime or size changed since the cached entry, the parsing is spread
+    across a process pool.
+    """
+    path = cache_path()
+    cache = read_cache(path)
+    files = {}
+    stale = []
+
+    for fileloc in paths:
+        stat = os.stat(fileloc)
+        entry = cache.get(fileloc)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            files[fileloc] = entry
+        else:
+            files[fileloc] = {"mtime": stat.st_mtime, "size": stat.st_size, "dags": []}
+            stale.append(fileloc)
+
+    logger.info(f"{len(paths) - len(stale)} dag files unchanged, {len(stale)} to parse")
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for fileloc, dags in zip(stale, executor.map(parse_file, stale, chunksize=8)):
+                files[fileloc]["dags"] = dags
+        cache.update(files)
+        write_cache(path, {fileloc: entry for fileloc, entry in cache.items() if os.path.exists(fileloc)})
+
+    infos = []
+    for fileloc, entry in files.items():
+        for dag_id, schedule_interval, start_date, is_subdag, timezone in entry["dags"]:
+            info = DagInfo(
+                dag_id,
+                is_paused=None,
+                is_subdag=is_subdag,
+                schedule_interval=decode_schedule(schedule_interval),
+                start_date=datetime.fromtimestamp(start_date, utc) if start_date else None,
+                fileloc=fileloc,
+                loader=loader,
+                timezone=timezone,
+            )
+            if schedule_interval[0] == "other":
+                del info.schedule_interval
+            infos.append((dag_id, info))
+
+    return infos
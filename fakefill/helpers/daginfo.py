@@ -0,0 +1,84 @@
+# standard library
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Optional
+
+# pypi/conda library
+from pytz import utc
+
+# fakefill plugin
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("daginfo")
+
+
+class DagInfo:
+    """ The fields of a dag the fill needs, read without parsing its file
+
+    Any other attribute (`create_dagrun`, `get_run_dates`...) is looked up on the real DAG, which `loader`
+    builds the first time it's needed. Fields left unknown, e.g. `start_date=None`, also fall back to it.
+    """
+
+    def __init__(
+        self,
+        dag_id: str,
+        is_paused: bool,
+        is_subdag: bool,
+        schedule_interval,
+        start_date: datetime = None,
+        fileloc: str = None,
+        loader: Callable = None,
+        timezone: str = None,
+    ):
+        self.dag_id = dag_id
+        self.is_paused = is_paused
+        self.is_subdag = is_subdag
+        self.schedule_interval = schedule_interval
+        if start_date is not None:
+            self.start_date = start_date
+        if timezone is not None:
+            self.timezone = timezone
+        self.fileloc = fileloc
+        self._loader = loader
+        self._dag = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"<DagInfo: {self.dag_id}>"
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get_dag(), name)
+
+    def get_dag(self):
+        with self._lock:
+            if self._dag is None:
+                if self._loader is None:
+                    raise AttributeError(f"{self.dag_id}: dag file cannot be parsed in this mode")
+                logger.debug(f"Parse the dag file of {self.dag_id}: {self.fileloc}")
+                self._dag = self._loader(self)
+        return self._dag
+
+
+def serialized_start_date(data: Optional[dict]) -> Optional[datetime]:
+    """ Start date of a dag from its `serialized_dag.data` json """
+    try:
+        return datetime.fromtimestamp(float(data["dag"]["start_date"]), utc)
+    except Exception:
+        return None
+
+
+def serialized_timezone(data: Optional[dict]) -> Optional[str]:
+    """ Timezone name of a dag from its `serialized_dag.data` json, offsets in seconds are kept as "+hh:mm" """
+    try:
+        timezone = data["dag"]["timezone"]
+    except Exception:
+        return None
+    if isinstance(timezone, dict):
+        # Airflow 1.10 wraps it: {"__type": "timezone", "__var": "UTC"}
+        timezone = timezone.get("__var")
+    if isinstance(timezone, (int, float)):
+        hours, minutes = divmod(abs(int(timezone)) // 60, 60)
+        return f"{'-' if timezone < 0 else '+'}{hours:02d}:{minutes:02d}"
+    return timezone
@@ -0,0 +1,121 @@
+# standard library
+from typing import Dict, List, Set, Tuple, Union
+
+# pypi/conda library
+from pytz import utc
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+# fakefill plugin
+from fakefill.helpers.cfutils import Datetime
+from fakefill.helpers.daginfo import DagInfo
+from fakefill.helpers.logging import getLogger
+from fakefill.helpers.schedule import to_epoch
+from fakefill.helpers.selection import fetch_in_chunks, last_executions, select_dags
+from fakefill.helpers.tables import dag_run_table, dag_table, decode_interval
+
+logger = getLogger("direct")
+
+# Same functions as afutils, on a `sql_alchemy_conn` url instead of the Airflow settings, set by `configure`
+engine = None
+Session = None
+
+
+def configure(sql_alchemy_conn: str, pool_size: int = 5):
+    global engine, Session
+
+    kwargs = {} if sql_alchemy_conn.startswith("sqlite") else {"pool_size": pool_size, "pool_pre_ping": True}
+    engine = create_engine(sql_alchemy_conn, **kwargs)
+    Session = sessionmaker(bind=engine)
+    logger.info(f"Direct database mode on {engine.url!r}, Airflow is not used")
+
+
+def get_session():
+    if Session is None:
+        raise RuntimeError("The direct database mode needs `configure(sql_alchemy_conn)` first")
+    return Session()
+
+
+def check_pool_size(workers: int):
+    try:
+        pool_size = engine.pool.size()
+    except Exception:
+        return
+
+    if pool_size < workers:
+        logger.warning(
+            f"Connection pool size is {pool_size} for {workers} workers, some workers will wait for a connection"
+        )
+
+
+def discover_dags(dag_ids: List[str] = None, get_pause_only: bool = False) -> List[Tuple[str, DagInfo]]:
+    """ Read the dags from the `dag` table, their files are never parsed """
+    columns = [
+        dag_table.c.dag_id,
+        dag_table.c.is_paused,
+        dag_table.c.is_subdag,
+        dag_table.c.schedule_interval,
+        dag_table.c.fileloc,
+    ]
+    query = select(columns)
+
+    if get_pause_only:
+        query = query.where(dag_table.c.is_paused.is_(True))
+
+    with engine.connect() as conn:
+        if dag_ids:
+            rows = fetch_in_chunks(
+                dag_ids, lambda chunk: conn.execute(query.where(dag_table.c.dag_id.in_(chunk))).fetchall()
+            )
+        else:
+            rows = conn.execute(query.where(dag_table.c.is_active.is_(True))).fetchall()
+
+    dags = []
+    for dag_id, is_paused, is_subdag, schedule_interval, fileloc in rows:
+        # the dag files are never parsed, the dags are taken in UTC, the default `core.default_timezone`
+        info = DagInfo(
+            dag_id,
+            bool(is_paused),
+            bool(is_subdag),
+            decode_interval(schedule_interval),
+            fileloc=fileloc,
+            timezone="UTC",
+        )
+        dags.append((dag_id, info))
+
+    logger.info(f"Discovered {len(dags)} dags from the metadata database")
+    return dags
+
+
+def fetch_dag(
+    dag_id: Union[str, List[str]], get_pause_only: bool, confirm: bool, discovery: str = "db"
+) -> List[Tuple[str, DagInfo]]:
+    """ Fetch one dag, "all" the dags, or a list of dag ids, always from the `dag` table """
+    if discovery != "db":
+        logger.info(f"Dag files are not parsed in the direct database mode, `{discovery}` discovery is ignored")
+
+    return select_dags(
+        dag_id,
+        confirm,
+        fetch_all=lambda: discover_dags(get_pause_only=get_pause_only),
+        fetch_ids=lambda dag_ids: discover_dags(dag_ids=dag_ids),
+    )
+
+
+def get_existing_dates(dag_id: str, since: Datetime) -> Set[int]:
+    """ Epoch seconds of the execution dates already in dag_run for a dag, from `since` onward """
+    query = select([dag_run_table.c.execution_date]).where(
+        (dag_run_table.c.dag_id == dag_id) & (dag_run_table.c.execution_date >= since.astimezone(utc))
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(query).fetchall()
+    return {to_epoch(execution_date) for execution_date, in rows}
+
+
+def get_last_executions(dag_ids: List[str]) -> Dict[str, Datetime]:
+    """ Latest execution date of each dag, one grouped query per chunk of dag ids """
+    query = select([dag_run_table.c.dag_id, func.max(dag_run_table.c.execution_date)]).group_by(dag_run_table.c.dag_id)
+    with engine.connect() as conn:
+        return last_executions(
+            dag_ids, lambda chunk: conn.execute(query.where(dag_run_table.c.dag_id.in_(chunk))).fetchall()
+        )
@@ -0,0 +1,202 @@
+# standard library
+import json
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+# pypi/conda library
+from pytz import utc
+
+# fakefill plugin
+from fakefill.helpers.cfutils import shard_suffix
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("journal")
+
+DEFAULT_JOURNAL = "fakefill.journal.jsonl"
+
+
+def journal_path(path: str, config_path: str, shard: Optional[Tuple[int, int]] = None) -> Path:
+    """ Use the given path, or keep the journal next to the config, or in the current folder, one per shard """
+    if path:
+        return Path(path)
+    if config_path:
+        return Path(f"{config_path}{shard_suffix(shard)}.journal.jsonl")
+    return Path.cwd() / DEFAULT_JOURNAL.replace(".journal", f"{shard_suffix(shard)}.journal")
+
+
+class Journal:
+    """ Append-only JSONL checkpoint of a fill
+
+    Two kinds of records are written:
+        {"dag_id": "dag_a", "done": true}
+        {"dag_id": "dag_b", "newest": "2020-11-28T00:00:00+00:00", "oldest": "2020-11-27T00:00:00+00:00"}
+    the latter being a span of execution dates committed. The commits of a dag are merged into a running span,
+    journaled every `span_every` dates or `flush_interval` seconds and once the dag is finished.
+
+    Records are buffered and written every `flush_every` records or `flush_interval` seconds.
+    """
+
+    def __init__(self, path: Path, flush_every: int = 100, flush_interval: float = 5.0, span_every: int = 10000):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.span_every = span_every
+        self.buffer: List[str] = []
+        self.flushed = monotonic()
+        self.spans: Dict[str, "RunningSpan"] = {}
+        self.lock = Lock()
+
+    def load(self) -> Tuple[Set[str], Dict[str, List[Tuple[datetime, datetime]]]]:
+        """ Return the finished dags, and the spans of committed execution dates of the others
+
+        Spans are kept apart, sorted and with the overlapping ones merged: a batch which failed or never
+        committed between two committed ones is written again.
+        """
+        finished = set()
+        committed = {}
+
+        if not self.path.is_file():
+            return finished, committed
+
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line can be cut if the process got killed while writing
+                    continue
+
+                dag_id = record["dag_id"]
+                if record.get("done"):
+                    finished.add(dag_id)
+                elif record.get("newest"):
+                    first = datetime.fromisoformat(record["oldest"]).astimezone(utc)
+                    last = datetime.fromisoformat(record["newest"]).astimezone(utc)
+                    committed.setdefault(dag_id, []).append((first, last))
+
+        for dag_id in finished:
+            committed.pop(dag_id, None)
+        committed = {dag_id: merge_spans(spans) for dag_id, spans in committed.items()}
+
+        logger.info(f"Resume from {self.path}: {len(finished)} dags done, {len(committed)} in progress")
+        return finished, committed
+
+    def done(self, dag_id: str):
+        self.append({"dag_id": dag_id, "done": True})
+
+    def on_commit(self, dag_id: str, run_dates: Sequence[datetime]) -> Callable:
+        """ `on_commit(newest, oldest)` of the writers for the next dates of a dag, merging its commits """
+        with self.lock:
+            span = self.spans.setdefault(dag_id, RunningSpan(self, dag_id))
+        span.follow(run_dates)
+        return span.commit
+
+    def close_span(self, dag_id: str):
+        """ Journal what is left of the running span of a dag """
+        with self.lock:
+            span = self.spans.pop(dag_id, None)
+        if span:
+            span.close()
+
+    def progress(self, dag_id: str, newest: datetime, oldest: datetime):
+        newest, oldest = newest.astimezone(utc).isoformat(), oldest.astimezone(utc).isoformat()
+        self.append({"dag_id": dag_id, "newest": newest, "oldest": oldest})
+
+    def reset(self):
+        with self.lock:
+            self.buffer = []
+            if self.path.is_file():
+                self.path.unlink()
+
+    def append(self, record: Dict):
+        with self.lock:
+            self.buffer.append(json.dumps(record))
+            if len(self.buffer) >= self.flush_every or monotonic() - self.flushed > self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            with open(self.path, "a") as file:
+                file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.flushed = monotonic()
+
+
+class RunningSpan:
+    """ Commits of one dag merged into one span of execution dates
+
+    Writers commit the dates they are given in order, newest first. A commit starting where the previous one stopped
+    extends the span, one starting further on journals the span and opens the next: the dates in between failed and
+    must be written again. The batches of the pipeline follow each other, a batch ending on a failure closes the span.
+    """
+
+    def __init__(self, journal: Journal, dag_id: str):
+        self.journal = journal
+        self.dag_id = dag_id
+        self.run_dates: Sequence[datetime] = []
+        # index in run_dates of the date after the last commit
+        self.position = 0
+        self.newest: Optional[datetime] = None
+        self.oldest: Optional[datetime] = None
+        # dates of the span not journaled yet
+        self.pending = 0
+        self.written = monotonic()
+
+    def follow(self, run_dates: Sequence[datetime]):
+        if self.position < len(self.run_dates):
+            self.close()
+        self.run_dates, self.position = run_dates, 0
+
+    def commit(self, newest: datetime, oldest: datetime):
+        if self.position < len(self.run_dates) and self.run_dates[self.position] == newest:
+            start = self.position
+        else:
+            self.close()
+            start = index_of(self.run_dates, newest, self.position)
+        self.position = start + 1 if oldest == newest else index_of(self.run_dates, oldest, start) + 1
+
+        self.newest = self.newest or newest
+        self.oldest = oldest
+        self.pending += self.position - start
+        if self.pending >= self.journal.span_every or monotonic() - self.written > self.journal.flush_interval:
+            self.write()
+
+    def write(self):
+        if self.pending:
+            self.journal.progress(self.dag_id, self.newest, self.oldest)
+            self.pending = 0
+        self.written = monotonic()
+
+    def close(self):
+        self.write()
+        self.newest = self.oldest = None
+
+
+def index_of(run_dates: Sequence[datetime], date: datetime, start: int) -> int:
+    """ Index of `date` in run_dates from `start` on, the dates being sorted newest first """
+    stop = len(run_dates)
+    while start < stop:
+        middle = (start + stop) // 2
+        if run_dates[middle] > date:
+            start = middle + 1
+        else:
+            stop = middle
+    return start
+
+
+def merge_spans(spans: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """ Sort the (oldest, newest) spans and merge the ones which overlap """
+    merged = []
+    for oldest, newest in sorted(spans):
+        if merged and oldest <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], newest))
+        else:
+            merged.append((oldest, newest))
+    return merged
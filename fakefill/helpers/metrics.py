@@ -0,0 +1,276 @@
+# standard library
+import json
+import math
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread, local
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+# pypi/conda library
+from pytz import utc
+
+# fakefill plugin
+from fakefill.helpers.cfutils import shard_suffix
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("metrics")
+
+DEFAULT_REPORT = "fakefill.report.json"
+# Upper bounds in seconds of the commit latency histogram, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_STATUSES = ("attempted", "inserted", "duplicate", "failed")
+
+
+def report_path(path: str, config_path: str, shard: Optional[Tuple[int, int]] = None) -> Path:
+    """ Use the given path, or keep the report next to the config, or in the current folder, one per shard """
+    if path:
+        return Path(path)
+    if config_path:
+        return Path(f"{config_path}{shard_suffix(shard)}.report.json")
+    return Path.cwd() / DEFAULT_REPORT.replace(".report", f"{shard_suffix(shard)}.report")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """ Nearest-rank percentile, `q` in [0, 1] """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def histogram_percentile(counts: List[int], q: float) -> Optional[float]:
+    """ Percentile of the latency histogram, interpolated inside its bucket """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    """ Wall time and counts of every stage and every dag of a fill
+
+    Stages are timed with `stage(name)`, the per-dag stages add up the time spent by all the workers. Commit
+    latencies are sent by the row limiter, and are attributed to the dag the calling thread `track`s.
+    """
+
+    def __init__(self, shard: Optional[Tuple[int, int]] = None):
+        self.shard = shard
+        self.started = datetime.utcnow().replace(tzinfo=utc)
+        self.lock = Lock()
+        self.stages: Dict[str, Dict] = {}
+        self.dags: Dict[str, Dict] = {}
+        self.rows = dict.fromkeys(ROW_STATUSES, 0)
+        self.dag_results = {"ok": 0, "failed": 0}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.current = local()
+
+    @contextmanager
+    def stage(self, name: str, count: int = 0):
+        started = monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "count": 0})
+                stage["seconds"] += monotonic() - started
+                stage["calls"] += 1
+                stage["count"] += count
+
+    def start_dag(self, dag_id: str) -> Dict:
+        record = {"dag_id": dag_id, "seconds": 0.0, "ok": False, "already_present": 0, **dict.fromkeys(ROW_STATUSES, 0)}
+        record["_started"] = monotonic()
+        record["_latencies"] = []
+        with self.lock:
+            self.dags[dag_id] = record
+        return record
+
+    @contextmanager
+    def track(self, record: Dict):
+        """ Attribute the commits of this thread to the dag of `record` """
+        self.current.record = record
+        try:
+            yield record
+        finally:
+            self.current.record = None
+
+    def add(self, record: Dict, **counts):
+        with self.lock:
+            for key, count in counts.items():
+                record[key] += count
+
+    def finish_dag(self, record: Dict):
+        with self.lock:
+            latencies = record.pop("_latencies")
+            record["seconds"] = round(monotonic() - record.pop("_started"), 6)
+            record["commits"] = len(latencies)
+            record["commit_p50"] = percentile(latencies, 0.5)
+            record["commit_p95"] = percentile(latencies, 0.95)
+            self.dag_results["ok" if record["ok"] else "failed"] += 1
+            for status in ROW_STATUSES:
+                self.rows[status] += record[status]
+
+    def observe_commit(self, latency: float, error: Exception = None):
+        record = getattr(self.current, "record", None)
+        with self.lock:
+            if record is not None and "_latencies" in record:
+                record["_latencies"].append(latency)
+            self.latency_buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return {
+                "shard": list(self.shard) if self.shard else None,
+                "started": self.started.isoformat(),
+                "finished": datetime.utcnow().replace(tzinfo=utc).isoformat(),
+                "dags": dict(self.dag_results),
+                "rows": dict(self.rows),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "commit_latency": {
+                    "count": sum(self.latency_buckets),
+                    "sum": self.latency_sum,
+                    "p50": histogram_percentile(self.latency_buckets, 0.5),
+                    "p95": histogram_percentile(self.latency_buckets, 0.95),
+                    "buckets": list(self.latency_buckets),
+                },
+                "per_dag": sorted(
+                    ({k: v for k, v in record.items() if not k.startswith("_")} for record in self.dags.values()),
+                    key=lambda record: record["dag_id"],
+                ),
+            }
+
+    def write_report(self, path: Path):
+        summary = self.summary()
+        with open(path, "w") as file:
+            json.dump(summary, file, indent=2, default=str)
+        logger.info(f"Report written to {path}")
+
+    def prometheus(self) -> str:
+        """ Current metrics in the Prometheus text format """
+        with self.lock:
+            lines = [
+                "# TYPE fakefill_rows_total counter",
+                *(f'fakefill_rows_total{{status="{status}"}} {count}' for status, count in self.rows.items()),
+                "# TYPE fakefill_dags_total counter",
+                *(f'fakefill_dags_total{{result="{result}"}} {count}' for result, count in self.dag_results.items()),
+                "# TYPE fakefill_stage_seconds_total counter",
+                *(
+                    f'fakefill_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}'
+                    for name, stage in self.stages.items()
+                ),
+                "# TYPE fakefill_commit_latency_seconds histogram",
+            ]
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), self.latency_buckets):
+                cumulative += count
+                lines.append(f'fakefill_commit_latency_seconds_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"fakefill_commit_latency_seconds_sum {self.latency_sum:.6f}")
+            lines.append(f"fakefill_commit_latency_seconds_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """ Expose `prometheus()` on http://127.0.0.1:<port>/metrics from a daemon thread """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        Thread(target=server.serve_forever, name="fakefill-metrics", daemon=True).start()
+        logger.info(f"Metrics served on http://127.0.0.1:{port}/metrics")
+        return server
+
+
+def merge_reports(reports: List[Dict]) -> Dict:
+    """ One report out of the reports of the shards of a run
+
+    Counts, stage times and latency histograms are added up, the stage times being the sum over the shards.
+    """
+    buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+    merged = {
+        "shards": [report.get("shard") for report in reports],
+        "started": min(report["started"] for report in reports),
+        "finished": max(report["finished"] for report in reports),
+        "dags": {"ok": 0, "failed": 0},
+        "rows": dict.fromkeys(ROW_STATUSES, 0),
+        "stages": {},
+        "commit_latency": {"count": 0, "sum": 0.0},
+        "per_dag": [],
+    }
+
+    for report in reports:
+        for result, count in report["dags"].items():
+            merged["dags"][result] = merged["dags"].get(result, 0) + count
+        for status, count in report["rows"].items():
+            merged["rows"][status] = merged["rows"].get(status, 0) + count
+        for name, stage in report["stages"].items():
+            total = merged["stages"].setdefault(name, {"seconds": 0.0, "calls": 0, "count": 0})
+            for key in total:
+                total[key] += stage.get(key, 0)
+        for i, count in enumerate(report["commit_latency"]["buckets"]):
+            buckets[i] += count
+        merged["commit_latency"]["sum"] += report["commit_latency"]["sum"]
+        merged["per_dag"] += report["per_dag"]
+
+    merged["commit_latency"].update(
+        count=sum(buckets),
+        p50=histogram_percentile(buckets, 0.5),
+        p95=histogram_percentile(buckets, 0.95),
+        buckets=buckets,
+    )
+    merged["per_dag"].sort(key=lambda record: record["dag_id"])
+    return merged
+
+
+def merge_report_files(paths: List[str], output: str):
+    reports = []
+    for path in paths:
+        with open(path) as file:
+            reports.append(json.load(file))
+
+    shards = [tuple(report["shard"]) for report in reports if report.get("shard")]
+    counts = {count for _, count in shards}
+    if len(counts) > 1:
+        logger.warning(f"The reports come from runs split in different numbers of shards: {sorted(counts)}")
+    for count in counts:
+        seen = [index for index, shard_count in shards if shard_count == count]
+        missing = sorted(set(range(count)) - set(seen))
+        duplicated = sorted({index for index in seen if seen.count(index) > 1})
+        if missing:
+            logger.warning(f"Missing shards of {count}: {missing}")
+        if duplicated:
+            logger.warning(f"Shards of {count} given more than once: {duplicated}")
+
+    merged = merge_reports(reports)
+    with open(output, "w") as file:
+        json.dump(merged, file, indent=2, default=str)
+
+    dags, rows, latency = merged["dags"], merged["rows"], merged["commit_latency"]
+    logger.success(
+        f"Merged {len(reports)} reports into {output}: {dags['ok']} dags ok, {dags['failed']} failed, "
+        f"{rows['inserted']} dag runs inserted, {rows['duplicate']} duplicate, {rows['failed']} failed"
+    )
+    if latency["count"]:
+        logger.info(f"Commit latency p50: {latency['p50']:.4f}s, p95: {latency['p95']:.4f}s")
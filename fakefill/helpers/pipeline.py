@@ -0,0 +1,124 @@
+# standard library
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Lock
+from typing import Callable, Iterator, List, Tuple
+
+# fakefill plugin
+from fakefill.helpers.cfutils import chunks
+from fakefill.helpers.logging import getLogger
+from fakefill.helpers.workers import BufferedLogger
+
+logger = getLogger("pipeline")
+
+
+class DagJob:
+    """ A dag going through the pipeline, done once every batch the producer queued has been written """
+
+    def __init__(self, dag_id: str, dag):
+        self.dag_id = dag_id
+        self.dag = dag
+        self.log = BufferedLogger()
+        self.pending = 0
+        self.produced = False
+        self.failed = False
+        self.finished = False
+        self.lock = Lock()
+
+
+def run_pipeline(
+    prepare: Callable,
+    write: Callable,
+    finish: Callable,
+    fail: Callable,
+    dagbag: List[Tuple],
+    writers: int,
+    queue_size: int,
+    batch_size: int,
+) -> Iterator:
+    """ Build the run dates of the next dags while the previous ones are being written
+
+    One producer thread calls `prepare(dag_id, dag, log) -> (run_dates, external_trigger) | None` for each dag and
+    queues its dates in batches of `batch_size`, `writers` threads call `write(dag_id, dag, batch, external_trigger,
+    log)` on them. Each writer has its own queue and all the batches of a dag go to the shortest one when the dag
+    starts, so they are written one after the other, newest first, and a crash leaves a contiguous span of the
+    dag committed. The queues hold at most `queue_size` batches in total, the producer waits when one is full so
+    the memory stays bounded whatever the number of dags. `fail(dag_id, log)` is called from the except block of
+    a failed stage, and `finish(dag_id, dag, log, ok)` once all the batches of a dag are written, its results come
+    back as the dags finish.
+    """
+    queues = [Queue(maxsize=max(1, queue_size // writers)) for _ in range(writers)]
+    results = Queue()
+
+    def complete(job: DagJob):
+        with job.lock:
+            if job.finished or not job.produced or job.pending:
+                return
+            job.finished = True
+        try:
+            results.put(finish(job.dag_id, job.dag, job.log, not job.failed))
+        except Exception as e:
+            results.put(e)
+        finally:
+            job.log.flush()
+
+    def produce():
+        try:
+            for turn, (dag_id, dag) in enumerate(dagbag):
+                job = DagJob(dag_id, dag)
+                try:
+                    prepared = prepare(dag_id, dag, job.log)
+                except Exception:
+                    job.failed = True
+                    fail(dag_id, job.log)
+                    prepared = None
+
+                if prepared:
+                    run_dates, external_trigger = prepared
+                    # shortest queue, ties taken in turn
+                    batches = queues[min(range(writers), key=lambda i: (queues[i].qsize(), (i - turn) % writers))]
+                    for batch in chunks(run_dates, batch_size):
+                        with job.lock:
+                            job.pending += 1
+                        batches.put((job, batch, external_trigger))
+
+                with job.lock:
+                    job.produced = True
+                complete(job)
+        except Exception as e:
+            results.put(e)
+        finally:
+            for queue in queues:
+                queue.put(None)
+
+    def consume(batches: Queue):
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+
+            job, batch, external_trigger = item
+            try:
+                # the other batches of a failed dag are dropped
+                if not job.failed:
+                    write(job.dag_id, job.dag, batch, external_trigger, job.log)
+            except Exception:
+                with job.lock:
+                    first, job.failed = not job.failed, True
+                if first:
+                    fail(job.dag_id, job.log)
+            finally:
+                with job.lock:
+                    job.pending -= 1
+                complete(job)
+
+    with ThreadPoolExecutor(max_workers=writers + 1, thread_name_prefix="fakefill") as executor:
+        executor.submit(produce)
+        for queue in queues:
+            executor.submit(consume, queue)
+
+        for _ in range(len(dagbag)):
+            result = results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield result
@@ -0,0 +1,289 @@
+# standard library
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from itertools import islice
+from math import ceil
+from typing import Iterable, List, Optional, Set, Sized, Tuple, Union
+
+try:
+    # pypi/conda library
+    from pendulum import Pendulum
+except ImportError:
+    try:
+        from pendulum import DateTime as Pendulum  # noqa
+    except ImportError:
+        # pendulum comes with airflow, the direct database mode runs without it
+        Pendulum = None
+
+# pypi/conda library
+from pytz import utc
+
+try:
+    # pypi/conda library
+    import numpy as np
+except ImportError:
+    np = None
+
+# fakefill plugin
+from fakefill.helpers.cfutils import Datetime
+from fakefill.helpers.cronvert import count_cron_dates, fixed_interval, iter_cron_dates, parse_cron
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("schedule")
+
+
+# Names of the timezones the fast paths compute the schedules in
+UTC_NAMES = {"UTC", "Etc/UTC", "UCT", "Etc/UCT", "GMT", "Etc/GMT", "Z", "+00:00"}
+
+
+def trans_to_datetime(dtobj: Union[Pendulum, Datetime]) -> Datetime:
+    if Pendulum is not None and isinstance(dtobj, Pendulum):
+        return datetime.fromtimestamp(dtobj.timestamp()).replace(tzinfo=utc)
+    elif isinstance(dtobj, datetime):
+        return dtobj
+    else:
+        return None
+
+
+def gen_run_id(start_date):
+    date = start_date.strftime("%Y-%m-%d")
+    time = start_date.strftime("%H:%M:%S")
+    tz_info = start_date.strftime("%z")
+    tz = f"{tz_info[:3]}:{tz_info[3:]}"
+    run_id = f"migration__{date}T{time}{tz}"
+    return run_id
+
+
+class EpochDates(Sequence):
+    """ Execution dates kept as int64 epoch seconds, turned into datetimes only when read
+
+    Backed by a numpy array when numpy is installed, `array("q")` otherwise.
+    """
+
+    def __init__(self, epochs):
+        self.epochs = epochs
+
+    @classmethod
+    def arange(cls, newest: int, step: int, count: int) -> "EpochDates":
+        """ `count` dates from `newest` backwards, every `step` seconds """
+        count = max(count, 0)
+        if np is not None:
+            return cls(newest - step * np.arange(count, dtype=np.int64))
+        return cls(array("q", range(newest, newest - step * count, -step)))
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return EpochDates(self.epochs[index])
+        return datetime.fromtimestamp(int(self.epochs[index]), utc)
+
+    def __repr__(self):
+        return f"EpochDates({len(self)} dates)"
+
+    def drop(self, epochs: Set[int]) -> "EpochDates":
+        if np is not None:
+            return EpochDates(self.epochs[~np.isin(self.epochs, np.fromiter(epochs, dtype=np.int64))])
+        return EpochDates(array("q", (e for e in self.epochs if e not in epochs)))
+
+    def drop_spans(self, oldest: List[int], newest: List[int]) -> "EpochDates":
+        """ Remove the dates inside any [oldest[i], newest[i]], the spans being sorted and disjoint """
+        if np is not None:
+            index = np.searchsorted(np.asarray(oldest, dtype=np.int64), self.epochs, side="right") - 1
+            inside = (index >= 0) & (self.epochs <= np.asarray(newest, dtype=np.int64)[np.maximum(index, 0)])
+            return EpochDates(self.epochs[~inside])
+        return EpochDates(array("q", (e for e in self.epochs if not in_spans(e, oldest, newest))))
+
+
+def to_epoch(date: Datetime) -> int:
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=utc)
+    return int(date.timestamp())
+
+
+def drop_dates(run_dates, epochs: Set[int]):
+    """ Remove the dates whose epoch seconds are in `epochs` """
+    if isinstance(run_dates, EpochDates):
+        return run_dates.drop(epochs)
+    return [rd for rd in run_dates if to_epoch(rd) not in epochs]
+
+
+def in_spans(epoch: int, oldest: List[int], newest: List[int]) -> bool:
+    index = bisect_right(oldest, epoch) - 1
+    return index >= 0 and epoch <= newest[index]
+
+
+def drop_spans(run_dates, spans: List[Tuple[Datetime, Datetime]]):
+    """ Remove the dates inside any of the (oldest, newest) spans, sorted and disjoint as `Journal.load` gives them """
+    oldest = [to_epoch(first) for first, _ in spans]
+    newest = [to_epoch(last) for _, last in spans]
+    if isinstance(run_dates, EpochDates):
+        return run_dates.drop_spans(oldest, newest)
+    return [rd for rd in run_dates if not in_spans(to_epoch(rd), oldest, newest)]
+
+
+def get_interval(schedule_interval) -> Optional[Tuple[int, int]]:
+    """ (step, offset) in seconds of a fixed-interval crontab or preset, or None """
+    try:
+        return fixed_interval(schedule_interval)
+    except Exception:
+        return None
+
+
+def gen_fixed_dates(step: int, offset: int, start_date: Datetime, limit: int) -> EpochDates:
+    """ The `limit` newest dates of `offset + k * step` between `start_date` and now """
+    now = to_epoch(datetime.utcnow())
+    newest = (now - offset) // step * step + offset
+    count = (newest - to_epoch(start_date)) // step + 1
+    return EpochDates.arange(newest, step, min(count, limit))
+
+
+def count_fixed_dates(step: int, offset: int, start: Datetime, end: Datetime) -> int:
+    """ Number of `offset + k * step` epoch seconds in [start, end) """
+    first = ceil((start.timestamp() - offset) / step)
+    last = ceil((end.timestamp() - offset) / step)
+    return max(0, last - first)
+
+
+def count_run_dates(schedule_interval, start: Datetime, end: Datetime, anchor: Datetime) -> Optional[int]:
+    """ Exact number of execution dates in [start, end), None if the schedule cannot be counted
+
+    `anchor` is where a timedelta schedule starts from.
+    """
+    if isinstance(schedule_interval, timedelta):
+        step = int(schedule_interval.total_seconds())
+        return count_fixed_dates(step, to_epoch(anchor) % step, start, end) if step > 0 else None
+
+    interval = get_interval(schedule_interval)
+    if interval:
+        return count_fixed_dates(*interval, start, end)
+
+    try:
+        return count_cron_dates(schedule_interval, start, end)
+    except Exception:
+        return None
+
+
+def get_window(start_date: Datetime, maximum_day: int, now: Datetime) -> Datetime:
+    """ Oldest date to fill: the start date, or `maximum_day` days ago if that's more recent """
+    if maximum_day:
+        return max(start_date, now - timedelta(days=maximum_day))
+    return start_date
+
+
+def get_process_num(schedule_interval, start_date: Datetime, maximum_day: int, maximum_unit: int) -> int:
+    """ Number of execution dates to fill: all the dates of the window, up to `maximum_unit` """
+    now = datetime.utcnow().replace(tzinfo=utc)
+    window = get_window(start_date, maximum_day, now)
+
+    count = count_run_dates(schedule_interval, window, now + timedelta(microseconds=1), anchor=start_date)
+    if count is None:
+        return maximum_unit
+    return min(maximum_unit, count)
+
+
+def timezone_name(timezone) -> str:
+    """ Name of a pendulum or pytz timezone """
+    return getattr(timezone, "name", None) or getattr(timezone, "zone", None) or str(timezone)
+
+
+def in_utc(dag) -> bool:
+    """ Whether the schedule of a dag fires in UTC, otherwise Airflow builds its run dates """
+    try:
+        timezone = dag.timezone
+    except AttributeError:
+        # no dag file to read it from, the discoveries set it to `core.default_timezone` otherwise
+        return True
+    return timezone is None or timezone_name(timezone) in UTC_NAMES
+
+
+def midnight(days_ago: int = 0) -> Datetime:
+    """ Midnight UTC, so that the runs of the same day get the same date and run id and are skipped as duplicates """
+    return datetime.utcnow().replace(tzinfo=utc, hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_ago)
+
+
+def placeholder_date() -> Datetime:
+    """ Filled when a schedule has no date in the window """
+    return midnight()
+
+
+def iter_run_dates(dag, start_date: Datetime, maximum_day: int, maximum_unit: int) -> Tuple[Iterable[Datetime], bool]:
+    """ Like `gen_run_dates`, but crontab dates are left as a lazy iterator """
+    # If schedule is None: set external trigger to True
+    if not dag.schedule_interval:
+        return [midnight(days_ago=1)], True
+
+    process_num = get_process_num(dag.schedule_interval, start_date, maximum_day, maximum_unit)
+
+    # The fast paths compute the schedules in UTC, crontabs of other timezones move with their DST
+    if not in_utc(dag):
+        return airflow_run_dates(dag, start_date, process_num), False
+
+    # Fixed interval: arithmetic progression of epoch seconds, airflow aligns timedelta on the start date
+    if isinstance(dag.schedule_interval, timedelta):
+        step = int(dag.schedule_interval.total_seconds())
+        interval = (step, to_epoch(start_date) % step) if step > 0 else None
+    else:
+        interval = get_interval(dag.schedule_interval)
+
+    if interval:
+        # possibly empty, `gen_run_dates` fills the placeholder date then
+        return gen_fixed_dates(*interval, start_date, process_num), False
+
+    try:
+        # walk the crontab backwards from now, only the first `process_num` dates get built
+        now = datetime.utcnow().replace(tzinfo=utc)
+        # the iterator is lazy, fail now if it's not a crontab
+        parse_cron(dag.schedule_interval)
+        return islice(iter_cron_dates(dag.schedule_interval, start_date, now), process_num), False
+    except Exception:
+        # @once, L / W / # crontabs... let airflow build the whole schedule
+        return airflow_run_dates(dag, start_date, process_num), False
+
+
+def airflow_run_dates(dag, start_date: Datetime, process_num: int) -> List[Datetime]:
+    """ The `process_num` newest run dates of `dag.get_run_dates` """
+    run_dates = dag.get_run_dates(start_date)
+    run_dates = [trans_to_datetime(rd) for rd in run_dates]
+    run_dates = [rd for rd in run_dates if rd]
+    run_dates.reverse()
+    return run_dates[:process_num] if len(run_dates) > process_num else run_dates
+
+
+def gen_run_dates(dag, start_date: Datetime, maximum_day: int, maximum_unit: int) -> Tuple[List[Datetime], bool]:
+    """ Return the execution dates to fill for a dag, newest first, and whether they are external triggers """
+    run_dates, external_trigger = iter_run_dates(dag, start_date, maximum_day, maximum_unit)
+
+    if not isinstance(run_dates, Sized):
+        run_dates = list(run_dates)
+
+    if not run_dates:
+        run_dates = [placeholder_date()]
+
+    return run_dates, external_trigger
+
+
+def summarize_run_dates(
+    dag, start_date: Datetime, maximum_day: int, maximum_unit: int
+) -> Tuple[int, Datetime, Datetime, bool]:
+    """ (count, newest, oldest, external_trigger) of the dates to fill, streamed instead of kept in memory """
+    run_dates, external_trigger = iter_run_dates(dag, start_date, maximum_day, maximum_unit)
+
+    if isinstance(run_dates, Sized):
+        count = len(run_dates)
+        newest, oldest = (run_dates[0], run_dates[-1]) if count else (None, None)
+    else:
+        count, newest, oldest = 0, None, None
+        for date in run_dates:
+            count += 1
+            newest = newest or date
+            oldest = date
+
+    if not count:
+        newest = oldest = placeholder_date()
+        return 1, newest, oldest, external_trigger
+
+    return count, newest, oldest, external_trigger
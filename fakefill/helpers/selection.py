@@ -0,0 +1,74 @@
+# standard library
+import sys
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+# pypi/conda library
+import click
+from pytz import utc
+
+# fakefill plugin
+from fakefill.helpers.cfutils import Datetime, chunks
+from fakefill.helpers.exceptions import DagNotFoundError
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("selection")
+
+# dag ids per `IN (...)` clause
+IN_CHUNK_SIZE = 500
+
+# The dag selection shared by the backends (afutils, direct), which only provide the queries
+
+
+def fetch_in_chunks(dag_ids: List[str], fetch: Callable[[List[str]], Iterable]) -> List:
+    """ Rows of `fetch(chunk)` for every chunk of IN_CHUNK_SIZE dag ids """
+    rows = []
+    for chunk in chunks(dag_ids, IN_CHUNK_SIZE):
+        rows += fetch(chunk)
+    return rows
+
+
+def select_dags(
+    dag_id: Union[str, List[str]],
+    confirm: bool,
+    fetch_all: Callable[[], List[Tuple]],
+    fetch_ids: Callable[[List[str]], List[Tuple]],
+) -> List[Tuple]:
+    """ Confirm, then fetch one dag, "all" the dags, or a list of dag ids resolved together, and report the missing """
+    dag_ids = [dag_id] if isinstance(dag_id, str) else list(dag_id)
+    label = dag_id if isinstance(dag_id, str) else f"{len(dag_ids)} dags"
+
+    msg = "You are going to backfill all the dags" if dag_id == "all" else f"You are going to backfill {label}?"
+
+    if not confirm and dag_id:
+        click.confirm(f"{msg}, sure about that?", abort=True)
+    elif dag_id == "all" and confirm:
+        logger.warning(msg)
+
+    if dag_id == "all":
+        dags = fetch_all()
+    elif dag_id:
+        dags = fetch_ids(dag_ids)
+    else:
+        logger.error("Unable to fetch dag(s). Need to assign a dag id")
+        sys.exit(-1)
+
+    if dag_id != "all":
+        found = {found_id for found_id, _ in dags}
+        missing = [missing_id for missing_id in dag_ids if missing_id not in found]
+        if missing and not dags:
+            raise DagNotFoundError(", ".join(missing))
+        elif missing:
+            logger.error(f"Unable to find {len(missing)} dags: {', '.join(missing)}")
+
+    return dags
+
+
+def last_executions(dag_ids: List[str], fetch: Callable[[List[str]], Iterable[Tuple]]) -> Dict[str, Datetime]:
+    """ Latest execution date of each dag, `fetch(chunk)` giving (dag_id, max execution_date) for a chunk of ids
+
+    sqlite & mysql give back the naive utc dates Airflow stored.
+    """
+    return {
+        dag_id: date.replace(tzinfo=utc) if date.tzinfo is None else date
+        for dag_id, date in fetch_in_chunks(dag_ids, fetch)
+    }
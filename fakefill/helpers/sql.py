@@ -1,8 +1,159 @@
-query_template = """insert into dag_run(dag_id, execution_date, run_id, state, external_trigger)
-values (
-  '%(dag_id)s',
-  '%(execution_date)s',
-  '%(run_id)s',
-  'success',
-  'false'
-);"""
+# standard library
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple, Union
+
+# pypi/conda library
+from pytz import utc
+
+DAG_RUN_COLUMNS = ("dag_id", "execution_date", "start_date", "run_id", "state", "external_trigger")
+# airflow.utils.state.State.SUCCESS, without importing airflow
+SUCCESS = "success"
+# How SQLAlchemy stores datetimes in sqlite, the microseconds are kept even when zero so that the unique
+# constraints see the rows Airflow wrote
+SQLITE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Duplicated rows are skipped by the database itself, whatever the dialect
+INSERT_PREFIX = {"sqlite": "insert or ignore", "mysql": "insert ignore"}
+CONFLICT_SUFFIX = {"postgresql": "\non conflict do nothing"}
+# Bound parameters allowed in one statement
+MAX_PARAMS = {"sqlite": 999, "postgresql": 65535, "mysql": 65535}
+
+TASK_INSTANCE_COLUMNS = (
+    "task_id",
+    "dag_id",
+    "execution_date",
+    "start_date",
+    "end_date",
+    "duration",
+    "state",
+    "try_number",
+    "max_tries",
+    "hostname",
+    "unixname",
+    "pool",
+    "queue",
+    "priority_weight",
+    "operator",
+)
+
+query_template = """%(insert)s into %(table)s(%(columns)s)
+values
+%(values)s%(conflict)s"""
+
+success_template = """update task_instance
+set state = :state, start_date = execution_date, end_date = execution_date, duration = 0, try_number = 1,
+    hostname = '', unixname = :unixname
+where dag_id = :dag_id and state is null and execution_date in (%(dates)s)"""
+
+# Postgres COPY: rows are staged in a temporary table, then merged in dag_run skipping duplicates
+STAGING_TABLE = "fakefill_dag_run_staging"
+
+staging_template = """create temp table if not exists %(table)s (
+    dag_id varchar(250),
+    execution_date timestamptz,
+    start_date timestamptz,
+    run_id varchar(250),
+    state varchar(50),
+    external_trigger boolean
+) on commit delete rows"""
+
+copy_template = """copy %(table)s(dag_id, execution_date, start_date, run_id, state, external_trigger)
+from stdin with csv"""
+
+merge_template = """insert into dag_run(dag_id, execution_date, start_date, run_id, state, external_trigger)
+select dag_id, execution_date, start_date, run_id, state, external_trigger from %(table)s
+on conflict do nothing"""
+
+
+def bind_date(date: datetime, dialect: str) -> Union[datetime, str]:
+    """ Postgres keeps the timezone, sqlite & mysql store naive utc like Airflow does """
+    date = date.astimezone(utc)
+    if dialect == "postgresql":
+        return date
+    if dialect == "sqlite":
+        return date.strftime(SQLITE_DATE_FORMAT)
+    return date.replace(tzinfo=None)
+
+
+def max_batch_size(dialect: str, batch_size: int, columns: Sequence[str] = DAG_RUN_COLUMNS) -> int:
+    limit = MAX_PARAMS.get(dialect)
+    if limit:
+        return max(1, min(batch_size, limit // len(columns)))
+    return batch_size
+
+
+def gen_insert_query(
+    dialect: str, rows: Sequence[Tuple], table: str = "dag_run", columns: Sequence[str] = DAG_RUN_COLUMNS
+) -> Tuple[str, Dict]:
+    """ Build one multi-row `INSERT ... VALUES` statement for a batch of rows
+
+    Each row follows `columns`. The statement ignores conflicts so that `rowcount` is the number of rows really
+    inserted.
+    """
+    values: List[str] = []
+    params: Dict = {}
+
+    for i, row in enumerate(rows):
+        values.append("(" + ", ".join(f":{column}_{i}" for column in columns) + ")")
+        for column, value in zip(columns, row):
+            if isinstance(value, datetime):
+                value = bind_date(value, dialect)
+            params[f"{column}_{i}"] = value
+
+    query = query_template % {
+        "insert": INSERT_PREFIX.get(dialect, "insert"),
+        "table": table,
+        "columns": ", ".join(columns),
+        "values": ",\n".join(values),
+        "conflict": CONFLICT_SUFFIX.get(dialect, ""),
+    }
+    return query, params
+
+
+def gen_success_query(dialect: str, dag_id: str, dates: Sequence[datetime], unixname: str) -> Tuple[str, Dict]:
+    """ Build the `UPDATE` setting to success the task instances of `dates` left without state
+
+    `dag.create_dagrun` adds those with `verify_integrity` before the task instances get inserted.
+    """
+    params: Dict = {"dag_id": dag_id, "state": SUCCESS, "unixname": unixname}
+    for i, date in enumerate(dates):
+        params[f"execution_date_{i}"] = bind_date(date, dialect)
+
+    query = success_template % {"dates": ", ".join(f":execution_date_{i}" for i in range(len(dates)))}
+    return query, params
+
+
+def to_value(value, dialect: str) -> str:
+    """ Text of a value in an export file, as the database loads it """
+    if isinstance(value, bool):
+        if dialect == "postgresql":
+            return "true" if value else "false"
+        return "1" if value else "0"
+    if isinstance(value, datetime):
+        value = bind_date(value, dialect)
+        return value if isinstance(value, str) else value.isoformat(sep=" ")
+    return str(value)
+
+
+def to_literal(value, dialect: str) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (bool, int, float)):
+        return to_value(value, dialect)
+    value = to_value(value, dialect).replace("'", "''")
+    if dialect == "mysql":
+        value = value.replace("\\", "\\\\")
+    return f"'{value}'"
+
+
+def gen_insert_sql(dialect: str, rows: Sequence[Tuple]) -> str:
+    """ Same statement as `gen_insert_query`, with the values inlined to be written in a file """
+    values = ["(" + ", ".join(to_literal(value, dialect) for value in row) + ")" for row in rows]
+    query = query_template % {
+        "insert": INSERT_PREFIX.get(dialect, "insert"),
+        "table": "dag_run",
+        "columns": ", ".join(DAG_RUN_COLUMNS),
+        "values": ",\n".join(values),
+        "conflict": CONFLICT_SUFFIX.get(dialect, ""),
+    }
+    return query + ";\n"
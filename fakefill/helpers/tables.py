@@ -0,0 +1,69 @@
+# standard library
+import json
+from datetime import timedelta
+
+# pypi/conda library
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+)
+
+# The columns of the Airflow metadata tables fakefill reads and writes, without importing Airflow
+metadata = MetaData()
+
+dag_table = Table(
+    "dag",
+    metadata,
+    Column("dag_id", String(250), primary_key=True),
+    Column("is_paused", Boolean, default=False),
+    Column("is_subdag", Boolean, default=False),
+    Column("is_active", Boolean, default=False),
+    Column("fileloc", String(2000)),
+    Column("schedule_interval", Text),
+)
+
+dag_run_table = Table(
+    "dag_run",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("dag_id", String(250)),
+    Column("execution_date", DateTime(timezone=True)),
+    Column("start_date", DateTime(timezone=True)),
+    Column("end_date", DateTime(timezone=True)),
+    Column("state", String(50)),
+    Column("run_id", String(250)),
+    Column("external_trigger", Boolean, default=True),
+    Column("conf", LargeBinary),
+    UniqueConstraint("dag_id", "execution_date"),
+    UniqueConstraint("dag_id", "run_id"),
+)
+
+
+def encode_interval(schedule_interval) -> str:
+    """ `dag.schedule_interval` as Airflow stores it, see `airflow.utils.sqlalchemy.Interval` """
+    if isinstance(schedule_interval, timedelta):
+        attrs = {"days": schedule_interval.days, "seconds": schedule_interval.seconds, "microseconds": 0}
+        return json.dumps({"type": "timedelta", "attrs": attrs})
+    return json.dumps(schedule_interval)
+
+
+def decode_interval(value: str):
+    if not value:
+        return None
+    data = json.loads(value)
+    if isinstance(data, dict):
+        if data["type"] == "timedelta":
+            return timedelta(**data["attrs"])
+        # pypi/conda library
+        from dateutil.relativedelta import relativedelta
+
+        return relativedelta(**data["attrs"])
+    return data
@@ -0,0 +1,78 @@
+# standard library
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable
+
+# fakefill plugin
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("throttle")
+
+LOCK_ERRORS = ("lock", "deadlock", "timeout", "could not serialize")
+
+
+def is_lock_error(error: Exception) -> bool:
+    message = f"{error}".lower()
+    return any(keyword in message for keyword in LOCK_ERRORS)
+
+
+class RateLimiter:
+    """ Token bucket refilled at `rate` tokens per second, rate <= 0 means no limit
+
+    The rate adapts to the database: it is halved when a commit is slower than `slow_latency` seconds or
+    hits a lock-wait error, and grows back by 20% per healthy commit until it reaches the target again.
+    `observer(latency, error)` is told about every commit, limited or not.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        name: str = "rows",
+        slow_latency: float = 1.0,
+        min_rate: float = None,
+        observer: Callable = None,
+    ):
+        self.name = name
+        self.observer = observer
+        self.target = float(rate)
+        self.rate = self.target
+        self.min_rate = min_rate or max(self.target / 100, 0.1)
+        self.slow_latency = slow_latency
+        self.tokens = self.target
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.target <= 0
+
+    def acquire(self, tokens: int = 1):
+        if self.unlimited:
+            return
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Borrow from the future: the next callers wait until the debt is paid back
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            sleep(wait)
+
+    def record(self, latency: float, error: Exception = None):
+        if self.observer:
+            self.observer(latency, error)
+
+        if self.unlimited:
+            return
+
+        with self.lock:
+            if (error is not None and is_lock_error(error)) or latency > self.slow_latency:
+                rate = max(self.min_rate, self.rate / 2)
+                if rate != self.rate:
+                    logger.debug(f"Database is slowing down, {self.name} rate: {self.rate:.1f}/s -> {rate:.1f}/s")
+                self.rate = rate
+            elif self.rate < self.target:
+                self.rate = min(self.target, self.rate * 1.2)
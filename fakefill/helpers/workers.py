@@ -0,0 +1,76 @@
+# standard library
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from threading import Lock
+from typing import Callable, Iterator, List, Tuple
+
+# fakefill plugin
+from fakefill.helpers.logging import getLogger
+
+logger = getLogger("workers")
+
+FLUSH_LOCK = Lock()
+
+
+class BufferedLogger:
+    """ Keep the log lines of one dag and write them in one go, so that workers don't interleave
+
+    Each line keeps the module, function and line it was logged from.
+    """
+
+    def __init__(self, logger_=logger):
+        self.logger = logger_
+        self.records: List[Tuple] = []
+
+    def __getattr__(self, level: str) -> Callable:
+        if level not in ("trace", "debug", "info", "success", "warning", "error", "critical"):
+            raise AttributeError(level)
+
+        def log(message: str):
+            self.records.append((level.upper(), message, None, caller()))
+
+        return log
+
+    def exception(self, message: str):
+        self.records.append(("ERROR", message, sys.exc_info(), caller()))
+
+    def flush(self):
+        with FLUSH_LOCK:
+            for level, message, exc_info, origin in self.records:
+                self.logger.patch(partial(relocate, origin)).opt(exception=exc_info).log(level, message)
+        self.records = []
+
+
+def caller(depth: int = 2) -> Tuple[str, str, int]:
+    """ (module, function, line) of the code which called the logging method, `depth` frames up """
+    frame = sys._getframe(depth)
+    return frame.f_globals.get("__name__", ""), frame.f_code.co_name, frame.f_lineno
+
+
+def relocate(origin: Tuple[str, str, int], record: dict):
+    """ Put a buffered line back where it was logged from, named like the logger of its module """
+    name, function, line = origin
+    module = name.rsplit(".", 1)[-1]
+    record.update(name=name, module=module, function=function, line=line)
+    record["extra"].update(name=module)
+    record["extra"].setdefault("padding", "")
+
+
+def run_parallel(func: Callable, dagbag: List[Tuple], workers: int) -> Iterator:
+    """ Call `func(dag_id, dag, log)` for each dag across a thread pool, results come back as they finish
+
+    Airflow sessions are thread local, so every worker writes through its own connection.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fakefill") as executor:
+        futures = [executor.submit(_run, func, dag_id, dag) for dag_id, dag in dagbag]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _run(func: Callable, dag_id: str, dag):
+    log = BufferedLogger()
+    try:
+        return func(dag_id, dag, log)
+    finally:
+        log.flush()
@@ -0,0 +1,486 @@
+# standard library
+import csv
+import gzip
+from getpass import getuser
+from io import StringIO
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import IO, Callable, Dict, List, Sequence, Tuple
+
+# pypi/conda library
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+# fakefill plugin
+from fakefill.helpers.cfutils import Datetime, batches, chunks, shard_of
+from fakefill.helpers.logging import getLogger
+from fakefill.helpers.schedule import gen_run_id
+from fakefill.helpers.sql import (
+    DAG_RUN_COLUMNS,
+    STAGING_TABLE,
+    SUCCESS,
+    TASK_INSTANCE_COLUMNS,
+    copy_template,
+    gen_insert_query,
+    gen_success_query,
+    gen_insert_sql,
+    max_batch_size,
+    merge_template,
+    staging_template,
+    to_value,
+)
+from fakefill.helpers.throttle import RateLimiter
+
+logger = getLogger("writers")
+
+# (inserted, skipped, failed)
+Result = Tuple[int, int, int]
+# Writers call `on_commit(newest, oldest)` with the span of execution dates each commit covers, in the order of the
+# dates given, and are closed once every dag has been written. They open their sessions with `session_factory()`,
+# the Airflow one by default
+
+
+class OrmWriter:
+    """ Write dag runs one by one through `dag.create_dagrun`
+
+    With `commit_size` > 1, DagRun objects are added to the session and committed `commit_size` at a time
+    instead. A batch hitting a duplicate is rolled back and written again row by row.
+    """
+
+    def __init__(self, limiter: RateLimiter, commit_size: int = 1, session_factory: Callable = None):
+        self.limiter = limiter
+        self.commit_size = max(1, commit_size)
+        self.session_factory = session_factory or airflow_session
+
+    def write(
+        self,
+        dag_id: str,
+        dag,
+        run_dates: List[Datetime],
+        external_trigger: bool,
+        log=logger,
+        on_commit: Callable = None,
+    ) -> Result:
+        if self.commit_size > 1:
+            return self.write_batches(dag_id, run_dates, external_trigger, log=log, on_commit=on_commit)
+
+        inserted = skipped = failed = 0
+
+        for date in run_dates:
+            self.limiter.acquire()
+            started = monotonic()
+            try:
+                sdate = execution_date = date
+                # generate run id -> migration_yyyy-mm-ddthh:mm:ss+00:00
+                run_id = gen_run_id(execution_date)
+                dag.create_dagrun(
+                    run_id=run_id,
+                    state=SUCCESS,
+                    execution_date=execution_date,
+                    start_date=sdate,
+                    external_trigger=external_trigger,
+                )
+            except IntegrityError:
+                skipped += 1
+                self.limiter.record(monotonic() - started)
+                if on_commit:
+                    on_commit(date, date)
+            except Exception as e:
+                log.debug(f"cannot auto backfill for {dag_id} on date {execution_date}")
+                failed += 1
+                self.limiter.record(monotonic() - started, error=e)
+            else:
+                inserted += 1
+                self.limiter.record(monotonic() - started)
+                if on_commit:
+                    on_commit(date, date)
+
+        return inserted, skipped, failed
+
+    def write_batches(
+        self, dag_id: str, run_dates: List[Datetime], external_trigger: bool, log=logger, on_commit: Callable = None
+    ) -> Result:
+        inserted = skipped = failed = 0
+        session = self.session_factory()
+
+        try:
+            for batch in chunks(run_dates, self.commit_size):
+                self.limiter.acquire(len(batch))
+                started = monotonic()
+                try:
+                    session.add_all([make_dagrun(dag_id, date, external_trigger) for date in batch])
+                    session.commit()
+                except IntegrityError:
+                    # Only this batch goes row by row
+                    session.rollback()
+                    self.limiter.record(monotonic() - started)
+                    ok, ko = self.write_rows(session, dag_id, batch, external_trigger, on_commit=on_commit)
+                    inserted += ok
+                    skipped += ko
+                    log.info(f"{dag_id}: batch of {len(batch)} rows, {ok} inserted, {ko} skipped")
+                except Exception as e:
+                    session.rollback()
+                    self.limiter.record(monotonic() - started, error=e)
+                    log.debug(f"cannot commit {len(batch)} dag runs for {dag_id}")
+                    failed += len(batch)
+                else:
+                    self.limiter.record(monotonic() - started)
+                    inserted += len(batch)
+                    if on_commit:
+                        on_commit(batch[0], batch[-1])
+        finally:
+            session.close()
+
+        return inserted, skipped, failed
+
+    def write_rows(
+        self, session, dag_id: str, run_dates: List[Datetime], external_trigger: bool, on_commit: Callable = None
+    ) -> Tuple[int, int]:
+        """ (inserted, skipped) committing the dag runs one at a time """
+        inserted = skipped = 0
+        for date in run_dates:
+            try:
+                session.add(make_dagrun(dag_id, date, external_trigger))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                skipped += 1
+            else:
+                inserted += 1
+            if on_commit:
+                on_commit(date, date)
+        return inserted, skipped
+
+    def close(self):
+        pass
+
+
+class BulkWriter:
+    """ Write dag runs in batches of multi-row `INSERT ... VALUES`, duplicates are skipped by the database """
+
+    def __init__(self, limiter: RateLimiter, batch_size: int = 1000, session_factory: Callable = None):
+        self.limiter = limiter
+        self.batch_size = max(1, batch_size)
+        self.session_factory = session_factory or airflow_session
+
+    def write(
+        self,
+        dag_id: str,
+        dag,
+        run_dates: List[Datetime],
+        external_trigger: bool,
+        log=logger,
+        on_commit: Callable = None,
+    ) -> Result:
+        inserted = skipped = failed = 0
+        session = self.session_factory()
+        dialect = session.bind.dialect.name
+
+        try:
+            for batch in chunks(run_dates, max_batch_size(dialect, self.batch_size)):
+                rows = [(dag_id, date, date, gen_run_id(date), SUCCESS, external_trigger) for date in batch]
+                self.limiter.acquire(len(rows))
+                started = monotonic()
+                try:
+                    ok = self.insert(session, dialect, rows)
+                except Exception as e:
+                    session.rollback()
+                    self.limiter.record(monotonic() - started, error=e)
+                    log.debug(f"cannot bulk insert {len(rows)} rows for {dag_id}")
+                    failed += len(rows)
+                    continue
+                else:
+                    self.limiter.record(monotonic() - started)
+                    if on_commit:
+                        on_commit(batch[0], batch[-1])
+
+                inserted += ok
+                skipped += len(rows) - ok
+                log.info(f"{dag_id}: batch of {len(rows)} rows, {ok} inserted, {len(rows) - ok} skipped")
+        finally:
+            session.close()
+
+        return inserted, skipped, failed
+
+    def insert(
+        self,
+        session,
+        dialect: str,
+        rows: List[Tuple],
+        table: str = "dag_run",
+        columns: Sequence[str] = DAG_RUN_COLUMNS,
+    ) -> int:
+        try:
+            query, params = gen_insert_query(dialect, rows, table=table, columns=columns)
+            ok = session.execute(text(query), params).rowcount
+            session.commit()
+        except IntegrityError:
+            # Dialect without conflict handling, go row by row for this batch only
+            session.rollback()
+            ok = 0
+            for row in rows:
+                try:
+                    query, params = gen_insert_query(dialect, [row], table=table, columns=columns)
+                    session.execute(text(query), params)
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                else:
+                    ok += 1
+        return ok
+
+    def close(self):
+        pass
+
+
+class CopyWriter(BulkWriter):
+    """ Write dag runs in batches with Postgres `COPY FROM STDIN`
+
+    Each batch is copied into a temporary staging table through the psycopg2 connection of the session, then
+    merged into dag_run with `INSERT ... SELECT ... ON CONFLICT DO NOTHING`. Other databases get the multi-row
+    inserts of BulkWriter.
+    """
+
+    def write(
+        self,
+        dag_id: str,
+        dag,
+        run_dates: List[Datetime],
+        external_trigger: bool,
+        log=logger,
+        on_commit: Callable = None,
+    ) -> Result:
+        inserted = skipped = failed = 0
+        session = self.session_factory()
+        dialect = session.bind.dialect.name
+
+        if dialect != "postgresql":
+            session.close()
+            log.warning(f"COPY needs Postgres, not {dialect}, {dag_id} is written with multi-row inserts")
+            return super().write(dag_id, dag, run_dates, external_trigger, log=log, on_commit=on_commit)
+
+        try:
+            for batch in chunks(run_dates, self.batch_size):
+                rows = [(dag_id, date, date, gen_run_id(date), SUCCESS, external_trigger) for date in batch]
+                self.limiter.acquire(len(rows))
+                started = monotonic()
+                try:
+                    ok = self.copy(session, rows)
+                except Exception as e:
+                    session.rollback()
+                    self.limiter.record(monotonic() - started, error=e)
+                    log.debug(f"cannot copy {len(rows)} rows for {dag_id}")
+                    failed += len(rows)
+                    continue
+                else:
+                    self.limiter.record(monotonic() - started)
+                    if on_commit:
+                        on_commit(batch[0], batch[-1])
+
+                inserted += ok
+                skipped += len(rows) - ok
+                log.info(f"{dag_id}: batch of {len(rows)} rows, {ok} inserted, {len(rows) - ok} skipped")
+        finally:
+            session.close()
+
+        return inserted, skipped, failed
+
+    def copy(self, session, rows: List[Tuple]) -> int:
+        buffer = StringIO()
+        csv.writer(buffer).writerows([to_value(value, "postgresql") for value in row] for row in rows)
+        buffer.seek(0)
+
+        # psycopg2 connection behind the session, in the same transaction
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.execute(staging_template % {"table": STAGING_TABLE})
+            cursor.copy_expert(copy_template % {"table": STAGING_TABLE}, buffer)
+            cursor.execute(merge_template % {"table": STAGING_TABLE})
+            ok = cursor.rowcount
+        finally:
+            cursor.close()
+
+        # the staging table is emptied on commit
+        session.commit()
+        return ok
+
+
+class TaskInstanceWriter(BulkWriter):
+    """ Write a task instance in state success for every task of the filled dag runs
+
+    The rows of a dag are generated from its tasks and inserted in batches of multi-row inserts ignoring the
+    task instances already there. Those left without state, as `create_dagrun` adds them through the orm writer,
+    are then set to success; the others keep theirs. The limiter is only told about the commit latency, so that
+    slow commits also slow down the dag runs, the task instances themselves are not throttled.
+    """
+
+    def write(self, dag_id: str, dag, run_dates: List[Datetime], log=logger) -> Result:
+        inserted = skipped = failed = 0
+        session = self.session_factory()
+        dialect = session.bind.dialect.name
+        unixname = getuser()
+
+        # Same for all the runs: (task_id, max_tries, pool, queue, priority_weight, operator)
+        tasks = [
+            (task.task_id, task.retries, task.pool, task.queue, task.priority_weight_total, type(task).__name__)
+            for task in dag.tasks
+        ]
+        rows = (
+            (task_id, dag_id, date, date, date, 0, SUCCESS, 1, retries, "", unixname, pool, queue, weight, op)
+            for date in run_dates
+            for task_id, retries, pool, queue, weight, op in tasks
+        )
+
+        try:
+            for batch in batches(rows, max_batch_size(dialect, self.batch_size, TASK_INSTANCE_COLUMNS)):
+                started = monotonic()
+                try:
+                    ok = self.insert(session, dialect, batch, table="task_instance", columns=TASK_INSTANCE_COLUMNS)
+                    ok += self.mark_success(session, dialect, dag_id, sorted({row[2] for row in batch}), unixname)
+                except Exception as e:
+                    session.rollback()
+                    self.limiter.record(monotonic() - started, error=e)
+                    log.debug(f"cannot bulk insert {len(batch)} task instances for {dag_id}")
+                    failed += len(batch)
+                    continue
+                else:
+                    self.limiter.record(monotonic() - started)
+
+                inserted += ok
+                skipped += len(batch) - ok
+        finally:
+            session.close()
+
+        log.info(f"{dag_id}: {inserted} task instances written, {skipped} skipped for {len(tasks)} tasks")
+        return inserted, skipped, failed
+
+    def mark_success(self, session, dialect: str, dag_id: str, dates: List[Datetime], unixname: str) -> int:
+        query, params = gen_success_query(dialect, dag_id, dates, unixname)
+        ok = session.execute(text(query), params).rowcount
+        session.commit()
+        return ok
+
+
+class ExportWriter:
+    """ Stream dag runs to gzip files instead of the database, to be loaded later with `COPY` or `LOAD DATA`
+
+    `path` ending with `.sql.gz` gets `INSERT` statements ignoring duplicates, anything else gets CSV rows of
+    DAG_RUN_COLUMNS with a header. With `shards` > 1, the dags are spread by hash of their id across
+    `name.<i>.csv.gz` files so that several loaders can run in parallel. Values are written the way the dialect
+    of the metadata database expects them.
+    """
+
+    def __init__(
+        self, path: str, batch_size: int = 1000, shards: int = 1, append: bool = False, session_factory: Callable = None
+    ):
+        path = Path(path)
+        self.path = path if path.suffix == ".gz" else path.with_name(f"{path.name}.gz")
+        self.fmt = "sql" if self.path.suffixes[-2:] == [".sql", ".gz"] else "csv"
+        self.batch_size = max(1, batch_size)
+        self.shards = max(1, shards)
+        self.mode = "at" if append else "wt"
+        self.dialect = None
+        self.files: Dict[int, IO] = {}
+        self.locks = [Lock() for _ in range(self.shards)]
+        self.lock = Lock()
+        self.session_factory = session_factory or airflow_session
+
+    def shard_path(self, index: int) -> Path:
+        if self.shards == 1:
+            return self.path
+        name, _, suffixes = self.path.name.partition(".")
+        return self.path.with_name(f"{name}.{index}.{suffixes}")
+
+    def open(self, index: int) -> IO:
+        with self.lock:
+            if self.dialect is None:
+                session = self.session_factory()
+                self.dialect = session.bind.dialect.name
+                session.close()
+
+            if index not in self.files:
+                path = self.shard_path(index)
+                header = self.fmt == "csv" and (self.mode == "wt" or not path.is_file())
+                self.files[index] = gzip.open(path, self.mode, newline="")
+                if header:
+                    csv.writer(self.files[index]).writerow(DAG_RUN_COLUMNS)
+                logger.info(f"Export dag runs to {path}")
+
+        return self.files[index]
+
+    def write(
+        self,
+        dag_id: str,
+        dag,
+        run_dates: List[Datetime],
+        external_trigger: bool,
+        log=logger,
+        on_commit: Callable = None,
+    ) -> Result:
+        index = shard_of(dag_id, self.shards)
+        file = self.open(index)
+        written = 0
+
+        for batch in chunks(run_dates, self.batch_size):
+            rows = [(dag_id, date, date, gen_run_id(date), SUCCESS, external_trigger) for date in batch]
+            with self.locks[index]:
+                if self.fmt == "sql":
+                    file.write(gen_insert_sql(self.dialect, rows))
+                else:
+                    csv.writer(file).writerows([to_value(value, self.dialect) for value in row] for row in rows)
+            written += len(rows)
+            if on_commit:
+                on_commit(batch[0], batch[-1])
+
+        log.info(f"{dag_id}: {written} rows exported to {self.shard_path(index)}")
+        return written, 0, 0
+
+    def close(self):
+        with self.lock:
+            for file in self.files.values():
+                file.close()
+            self.files = {}
+
+
+def airflow_session():
+    # fakefill plugin
+    from fakefill.helpers.afutils import get_session
+
+    return get_session()
+
+
+def make_dagrun(dag_id: str, execution_date: Datetime, external_trigger: bool):
+    """ The dag run `dag.create_dagrun` would add, without committing it """
+    # airflow library
+    from airflow.models import DagRun
+
+    return DagRun(
+        dag_id=dag_id,
+        run_id=gen_run_id(execution_date),
+        execution_date=execution_date,
+        start_date=execution_date,
+        external_trigger=external_trigger,
+        state=SUCCESS,
+    )
+
+
+def get_writer(
+    writer: str,
+    batch_size: int,
+    limiter: RateLimiter,
+    export: str = "",
+    export_files: int = 1,
+    append: bool = False,
+    commit_size: int = 1,
+    session_factory: Callable = None,
+):
+    if export:
+        return ExportWriter(
+            export, batch_size=batch_size, shards=export_files, append=append, session_factory=session_factory
+        )
+    if writer == "copy":
+        return CopyWriter(limiter=limiter, batch_size=batch_size, session_factory=session_factory)
+    if writer == "bulk":
+        return BulkWriter(limiter=limiter, batch_size=batch_size, session_factory=session_factory)
+    return OrmWriter(limiter=limiter, commit_size=commit_size, session_factory=session_factory)
@@ -0,0 +1,111 @@
+# standard library
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import NoReturn, Optional
+
+# fakefill plugin
+from fakefill.catchup import DEFAULT_ROW_RATE, collect_dags, get_backend
+from fakefill.helpers.cfutils import Datetime, parse_bool, parse_date, read_config
+from fakefill.helpers.cronvert import cache_info
+from fakefill.helpers.logging import getLogger
+from fakefill.helpers.schedule import summarize_run_dates
+
+logger = getLogger("planner")
+
+PLAN_COLUMNS = ("dag_id", "rows", "newest", "oldest", "external_trigger", "seconds")
+
+
+@contextmanager
+def open_output(output: str):
+    """ "-" is stdout, mind that the logs go there too """
+    if output == "-":
+        yield sys.stdout
+    else:
+        with open(output, "w", newline="") as file:
+            yield file
+
+
+def plan(
+    dag_id: str,
+    start_date: Datetime,
+    maximum_day: int,
+    maximum_unit: int,
+    config_path: str,
+    p: bool,
+    discovery: str = "dagbag",
+    writer: str = "orm",
+    row_rate: Optional[float] = None,
+    output: str = "",
+    fmt: str = "csv",
+    sql_alchemy_conn: str = "",
+) -> NoReturn:
+    """ Write what `fakefill run` would fill, one row per dag, without writing to the database """
+    dag_id = dag_id.lower().strip()
+
+    # Read only not ""
+    if config_path:
+        configs = read_config(config_path)
+    else:
+        configs = {}
+
+    # General settings, same as `fakefill run`
+    start_date = parse_date(configs.get("settings", {}).get("start_date", start_date)) - timedelta(days=180)
+    maximum_day = int(configs.get("settings", {}).get("maximum_day", maximum_day))
+    maximum_unit = int(configs.get("settings", {}).get("maximum_unit", maximum_unit))
+    pause_only = parse_bool(configs.get("settings", {}).get("pause_only", p))
+    discovery = configs.get("settings", {}).get("discovery", discovery)
+    writer = configs.get("settings", {}).get("writer", writer)
+    export = configs.get("settings", {}).get("export", "")
+    sql_alchemy_conn = configs.get("settings", {}).get("sql_alchemy_conn", sql_alchemy_conn)
+    # Same rate as `fakefill run`: only the orm writer is limited by default, it falls back to bulk without Airflow
+    row_rate = configs.get("settings", {}).get("row_rate", row_rate)
+    if row_rate is None:
+        row_rate = DEFAULT_ROW_RATE if writer == "orm" and not export and not sql_alchemy_conn else 0
+    row_rate = float(row_rate)
+    output = output or str(Path.cwd() / f"fakefill_plan.{fmt}")
+
+    backend = get_backend(sql_alchemy_conn)
+    dagbag = collect_dags(dag_id, configs, pause_only=pause_only, confirm=True, discovery=discovery, backend=backend)
+    logger.info(f"Plan {len(dagbag)} dags")
+
+    total_dags = total_rows = 0
+
+    with open_output(output) as file:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(PLAN_COLUMNS)
+
+        for dag_id, dag in dagbag:
+            # Subdag will be ignored
+            if dag.is_subdag:
+                continue
+
+            try:
+                rows, newest, oldest, external_trigger = summarize_run_dates(dag, start_date, maximum_day, maximum_unit)
+            except Exception:
+                logger.error(f"Cannot plan dag: {dag_id}")
+                continue
+
+            seconds = round(rows / row_rate, 1) if row_rate > 0 else None
+            record = (dag_id, rows, newest.isoformat(), oldest.isoformat(), external_trigger, seconds)
+
+            if fmt == "csv":
+                writer.writerow(record)
+            else:
+                file.write(json.dumps(dict(zip(PLAN_COLUMNS, record))) + "\n")
+
+            total_dags += 1
+            total_rows += rows
+
+    if row_rate > 0:
+        estimate = f", about {timedelta(seconds=round(total_rows / row_rate))} at {row_rate:g} rows/s"
+    else:
+        estimate = ", no time estimate as the writes are not rate limited (pass -rr)"
+    logger.success(f"Planned {total_rows} dag runs for {total_dags} dags{estimate}, written to {output}")
+
+    cron_cache = cache_info()
+    logger.info(f"Parsed crontabs cache: {cron_cache.hits} hits, {cron_cache.misses} misses")